@@ -1,3 +1,4 @@
+import copy
 import torch
 import torch.nn.functional as F
 from torch import nn
@@ -121,6 +122,14 @@ vgg = nn.Sequential(
     nn.ReLU()  # relu5-4
 )
 
+def load_vgg(path, map_location='cpu'):
+    """ VGG encoder up to relu5_1 with pretrained weights. Only the training losses use it,
+        so inference builds StyTrans without it. The module-level vgg is left untouched.
+    """
+    encoder = copy.deepcopy(vgg)
+    encoder.load_state_dict(torch.load(path, map_location=map_location))
+    return nn.Sequential(*list(encoder.children())[:44])
+
 class MLP(nn.Module):
     """ Very simple multi-layer perceptron (also called FFN)"""
 
@@ -140,6 +149,19 @@ class StyTrans(nn.Module):
     def __init__(self,encoder,decoder,PatchEmbed, transformer,args):
 
         super().__init__()
+        # encoder (VGG) is only needed for the losses in forward; pass None for inference
+        self.has_encoder = False
+        if encoder is not None:
+            self.set_encoder(encoder)
+
+        self.mse_loss = nn.MSELoss()
+        self.transformer = transformer
+        hidden_dim = transformer.d_model       
+        self.decode = decoder
+        self.embedding = PatchEmbed
+
+    def set_encoder(self, encoder):
+        """ Attach the frozen VGG encoder used by forward and the loss terms """
         enc_layers = list(encoder.children())
         self.enc_1 = nn.Sequential(*enc_layers[:4])  # input -> relu1_1
         self.enc_2 = nn.Sequential(*enc_layers[4:11])  # relu1_1 -> relu2_1
@@ -150,14 +172,12 @@ class StyTrans(nn.Module):
         for name in ['enc_1', 'enc_2', 'enc_3', 'enc_4', 'enc_5']:
             for param in getattr(self, name).parameters():
                 param.requires_grad = False
-
-        self.mse_loss = nn.MSELoss()
-        self.transformer = transformer
-        hidden_dim = transformer.d_model       
-        self.decode = decoder
-        self.embedding = PatchEmbed
+        self.has_encoder = True
 
     def encode_with_intermediate(self, input):
+        if not self.has_encoder:
+            raise RuntimeError("StyTrans was built without the VGG encoder; call set_encoder(load_vgg(path)) "
+                               "before computing losses")
         results = [input]
         for i in range(5):
             func = getattr(self, 'enc_{:d}'.format(i + 1))
@@ -227,4 +247,145 @@ class StyTrans(nn.Module):
             loss_lambda2 += self.calc_content_loss(Icc_feats[i], content_feats[i])+self.calc_content_loss(Iss_feats[i], style_feats[i])
         # Please select and comment out one of the following two sentences
         # return Ics,  loss_c, loss_s, loss_lambda1, loss_lambda2   #train
-        return Ics    #test 
\ No newline at end of file
+        return Ics    #test 
+
+    @torch.inference_mode()
+    def encode_style(self, samples_s):
+        """ Style stage (PatchEmbed + encoder_s); the returned HWxNxC memory can be
+            reused for any number of content images.
+        """
+        samples_s = _as_tensor(samples_s)
+        return self.transformer.encode_style(self.embedding(samples_s))
+
+    @torch.inference_mode()
+    def encode_content(self, samples_c):
+        """ Content stage (PatchEmbed + content-aware positional embedding + encoder_c).
+            Returns the (memory, positional embedding, (h, w) token grid) triple expected by stylize.
+        """
+        samples_c = _as_tensor(samples_c)
+        content = self.embedding(samples_c)
+        memory_c, pos_embed_c = self.transformer.encode_content(content)
+        return memory_c, pos_embed_c, tuple(content.shape[-2:])
+
+    @torch.inference_mode()
+    def stylize(self, content_memory, style_memory):
+        """ Cross-attention decoding and CNN decoder over precomputed stage outputs """
+        memory_c, pos_embed_c, grid_size = content_memory
+        hs = self.transformer.decode(memory_c, style_memory, pos_embed_c, grid_size)
+        return self.decode(hs)
+
+    @torch.inference_mode()
+    def stylize_alphas(self, samples_c, style_memory, alphas):
+        """ Strength sweep in feature space. The content memory is decoded against the style memory
+            (stylized features) and against the content encoded as a style (the identity features
+            that give Icc in forward), then the CNN decoder decodes
+            alpha * stylized + (1 - alpha) * identity for every alpha in one batch.
+            Returns len(alphas)*N images, grouped by alpha in the order given.
+        """
+        samples_c = _as_tensor(samples_c)
+        content = self.embedding(samples_c)
+        memory_c, pos_embed_c = self.transformer.encode_content(content)
+        grid_size = tuple(content.shape[-2:])
+        hs = self.transformer.decode(memory_c, style_memory, pos_embed_c, grid_size)
+        hcc = self.transformer.decode(memory_c, self.transformer.encode_style(content), pos_embed_c, grid_size)
+        return self.decode(torch.cat([torch.lerp(hcc, hs, alpha) for alpha in alphas]))
+
+    @torch.inference_mode()
+    def inference(self, samples_c=None, samples_s=None, style_memory=None, content_memory=None):
+        """ Inference-only path: embed -> transformer -> decode.
+            Unlike forward, no VGG features, identity passes (Icc, Iss) or loss terms are computed.
+            Each stage is skipped when its precomputed output (style_memory from encode_style,
+            content_memory from encode_content) is given instead of the images.
+        """
+        if style_memory is None:
+            style_memory = self.encode_style(samples_s)
+        if content_memory is None:
+            content_memory = self.encode_content(samples_c)
+        return self.stylize(content_memory, style_memory)
+
+    @torch.inference_mode()
+    def inference_batch(self, samples_c, samples_s=None, style_memory=None):
+        """ One style, many contents: the style is encoded once and its memory is broadcast
+            across the batch. samples_c is an NxCxHxW tensor or a list of same-sized CxHxW images.
+        """
+        if isinstance(samples_c, list):
+            samples_c = torch.stack(samples_c)
+        if style_memory is None:
+            style_memory = self.encode_style(samples_s)
+        style_memory = style_memory.expand(-1, samples_c.shape[0], -1)
+        return self.inference(samples_c, style_memory=style_memory)
+
+    @torch.inference_mode()
+    def inference_tiled(self, samples_c, samples_s=None, style_memory=None, tile_size=512, overlap=64, batch_size=4,
+                        stylize_fn=None):
+        """ Inference over overlapping tiles for images too large for full attention.
+            All tiles share one style memory and are stylized batch_size at a time, so peak
+            activation memory depends on tile_size and batch_size, not on the image size.
+            Seams are hidden by feather-blending the overlaps with linear ramps.
+            stylize_fn(tiles, style_memory) replaces inference_batch, e.g. with a compiled graph.
+        """
+        samples_c = _as_tensor(samples_c)
+        if style_memory is None:
+            style_memory = self.encode_style(samples_s)
+        return stylize_tiled(samples_c, style_memory, stylize_fn or self.inference_batch, self.embedding.patch_size[0],
+                             tile_size=tile_size, overlap=overlap, batch_size=batch_size)
+
+
+@torch.inference_mode()
+def stylize_tiled(samples_c, style_memory, stylize_fn, patch, tile_size=512, overlap=64, batch_size=4):
+    """ The tiling of StyTrans.inference_tiled around any stylize_fn(tiles, style_memory=...),
+        e.g. an ONNX Runtime session, for a network with the given patch size.
+    """
+    if tile_size < patch:
+        raise ValueError(f"tile_size should be at least the patch size {patch}, not {tile_size}")
+    if not 0 <= overlap < tile_size:
+        raise ValueError(f"overlap should be at least 0 and below tile_size {tile_size}, not {overlap}")
+
+    B, _, H, W = samples_c.shape
+    tile_h = min(tile_size, H) // patch * patch
+    tile_w = min(tile_size, W) // patch * patch
+    tiles = [(y, x) for y in _tile_starts(H, tile_h, overlap, patch)
+             for x in _tile_starts(W, tile_w, overlap, patch)]
+
+    weight = _feather_mask(tile_h, tile_w, overlap).to(samples_c)
+    norm = samples_c.new_zeros(H, W)
+    for y, x in tiles:
+        norm[y:y + tile_h, x:x + tile_w] += weight
+
+    output = samples_c.new_zeros(B, 3, H, W)
+    for b in range(B):
+        for i in range(0, len(tiles), batch_size):
+            chunk = tiles[i:i + batch_size]
+            batch = torch.stack([samples_c[b, :, y:y + tile_h, x:x + tile_w] for y, x in chunk])
+            stylized = stylize_fn(batch, style_memory=style_memory)
+            for (y, x), tile in zip(chunk, stylized):
+                output[b, :, y:y + tile_h, x:x + tile_w] += tile * weight
+    return output / norm
+
+
+def _tile_starts(length, tile, overlap, step_min=1):
+    """ Start offsets of tiles covering [0, length); the last tile is aligned to the end """
+    if length <= tile:
+        return [0]
+    step = max(tile - overlap, step_min)
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+def _feather_mask(h, w, overlap):
+    """ HxW blending weights ramping linearly from the tile borders over overlap pixels """
+    def ramp(n):
+        d = torch.arange(n, dtype=torch.float32)
+        d = torch.minimum(d, n - 1 - d)
+        return ((d + 1) / (overlap + 1)).clamp(max=1.0)
+    return ramp(h)[:, None] * ramp(w)[None, :]
+
+
+def _as_tensor(samples):
+    """ Batched image tensor from a tensor, list of images or NestedTensor (inference needs no mask) """
+    if isinstance(samples, list):
+        samples = nested_tensor_from_tensor_list(samples)
+    if isinstance(samples, NestedTensor):
+        samples = samples.tensors
+    return samples
@@ -42,36 +42,81 @@ class Transformer(nn.Module):
             if p.dim() > 1:
                 nn.init.xavier_uniform_(p)
 
-    def forward(self, style, mask , content, pos_embed_c, pos_embed_s):
-
+    def set_attention_backend(self, backend="native", chunk_size=1024):
+        """ Select how every encoder/decoder layer computes attention (see multi_head_attention).
+            The weights are shared by all backends, so this can be changed after loading a checkpoint.
+        """
+        if backend not in ATTENTION_BACKENDS:
+            raise ValueError(f"attention backend should be one of {ATTENTION_BACKENDS}, not {backend}.")
+        for layer in list(self.encoder_c.layers) + list(self.encoder_s.layers) + list(self.decoder.layers):
+            layer.attention_backend = backend
+            layer.attention_chunk_size = chunk_size
+
+    def encode_style(self, style, mask=None, pos_embed_s=None):
+        """ Style stage: flatten NxCxHxW to HWxNxC and run encoder_s.
+            The result does not depend on the content and can be cached per style image.
+        """
+        style = style.flatten(2).permute(2, 0, 1)
+        if pos_embed_s is not None:
+            pos_embed_s = pos_embed_s.flatten(2).permute(2, 0, 1)
+        return self.encoder_s(style, src_key_padding_mask=mask, pos=pos_embed_s)
+
+    @staticmethod
+    def reduce_style(memory_s, num_tokens):
+        """ Style-token reduction: average-pool the HWxNxC style memory to num_tokens tokens.
+            Style memories carry no positional embedding, so attention only sees them as a set
+            and near-equal pools keep the attention mass balanced. Decoder cost then no longer
+            grows with the style resolution.
+        """
+        if num_tokens is None or memory_s.shape[0] <= num_tokens:
+            return memory_s
+        pooled = F.adaptive_avg_pool1d(memory_s.permute(1, 2, 0), num_tokens)
+        return pooled.permute(2, 0, 1)
+
+    def encode_content(self, content, mask=None):
+        """ Content stage: content-aware positional embedding, then encoder_c.
+            Returns the HWxNxC content memory and its HWxNxC positional embedding.
+        """
         # content-aware positional embedding
         content_pool = self.averagepooling(content)       
         pos_c = self.new_ps(content_pool)
-        pos_embed_c = F.interpolate(pos_c, mode='bilinear',size= style.shape[-2:])
+        pos_embed_c = F.interpolate(pos_c, mode='bilinear',size= content.shape[-2:])
 
         ###flatten NxCxHxW to HWxNxC     
-        style = style.flatten(2).permute(2, 0, 1)
-        if pos_embed_s is not None:
-            pos_embed_s = pos_embed_s.flatten(2).permute(2, 0, 1)
-      
         content = content.flatten(2).permute(2, 0, 1)
-        if pos_embed_c is not None:
-            pos_embed_c = pos_embed_c.flatten(2).permute(2, 0, 1)
-     
-        
-        style = self.encoder_s(style, src_key_padding_mask=mask, pos=pos_embed_s)
+        pos_embed_c = pos_embed_c.flatten(2).permute(2, 0, 1)
+
         content = self.encoder_c(content, src_key_padding_mask=mask, pos=pos_embed_c)
-        hs = self.decoder(content, style, memory_key_padding_mask=mask,
+        return content, pos_embed_c
+
+    def decode(self, memory_c, memory_s, pos_embed_c, grid_size, mask=None, pos_embed_s=None):
+        """ Cross-attention stage over given content and style memories (all HWxNxC).
+            grid_size is the (h, w) token grid of the content, which need not be square.
+            Returns NxCxHxW features for the CNN decoder.
+        """
+        hs = self.decoder(memory_c, memory_s, memory_key_padding_mask=mask,
                           pos=pos_embed_s, query_pos=pos_embed_c)[0]
         
         ### HWxNxC to NxCxHxW to
         N, B, C= hs.shape          
-        H = int(np.sqrt(N))
+        h, w = grid_size
+        assert h * w == N, "grid_size does not match the number of content tokens"
         hs = hs.permute(1, 2, 0)
-        hs = hs.view(B, C, -1,H)
+        hs = hs.view(B, C, h, w)
 
         return hs
 
+    def forward(self, style, mask , content, pos_embed_c, pos_embed_s, memory_s=None):
+
+        # precomputed encoder_s output (see encode_style) skips the style branch
+        if memory_s is None:
+            memory_s = self.encode_style(style, mask, pos_embed_s)
+        memory_c, pos_embed_c = self.encode_content(content, mask)
+
+        if pos_embed_s is not None:
+            pos_embed_s = pos_embed_s.flatten(2).permute(2, 0, 1)
+        return self.decode(memory_c, memory_s, pos_embed_c, content.shape[-2:], mask, pos_embed_s)
+
 
 class TransformerEncoder(nn.Module):
 
@@ -156,10 +201,16 @@ class TransformerEncoderLayer(nn.Module):
 
         self.activation = _get_activation_fn(activation)
         self.normalize_before = normalize_before
+        self.attention_backend = "native"
+        self.attention_chunk_size = 1024
 
     def with_pos_embed(self, tensor, pos: Optional[Tensor]):
         return tensor if pos is None else tensor + pos
 
+    def attend(self, attn, query, key, value, attn_mask=None, key_padding_mask=None):
+        return multi_head_attention(attn, query, key, value, attn_mask, key_padding_mask,
+                                    self.attention_backend, self.attention_chunk_size)
+
     def forward_post(self,
                      src,
                      src_mask: Optional[Tensor] = None,
@@ -168,8 +219,8 @@ class TransformerEncoderLayer(nn.Module):
         q = k = self.with_pos_embed(src, pos)
         # q = k = src
         # print(q.size(),k.size(),src.size())
-        src2 = self.self_attn(q, k, value=src, attn_mask=src_mask,
-                              key_padding_mask=src_key_padding_mask)[0]
+        src2 = self.attend(self.self_attn, q, k, src, attn_mask=src_mask,
+                           key_padding_mask=src_key_padding_mask)
         src = src + self.dropout1(src2)
         src = self.norm1(src)
         src2 = self.linear2(self.dropout(self.activation(self.linear1(src))))
@@ -183,8 +234,8 @@ class TransformerEncoderLayer(nn.Module):
                     pos: Optional[Tensor] = None):
         src2 = self.norm1(src)
         q = k = self.with_pos_embed(src2, pos)
-        src2 = self.self_attn(q, k, value=src2, attn_mask=src_mask,
-                              key_padding_mask=src_key_padding_mask)[0]
+        src2 = self.attend(self.self_attn, q, k, src2, attn_mask=src_mask,
+                           key_padding_mask=src_key_padding_mask)
         src = src + self.dropout1(src2)
         src2 = self.norm2(src)
         src2 = self.linear2(self.dropout(self.activation(self.linear1(src2))))
@@ -222,10 +273,16 @@ class TransformerDecoderLayer(nn.Module):
 
         self.activation = _get_activation_fn(activation)
         self.normalize_before = normalize_before
+        self.attention_backend = "native"
+        self.attention_chunk_size = 1024
 
     def with_pos_embed(self, tensor, pos: Optional[Tensor]):
         return tensor if pos is None else tensor + pos
 
+    def attend(self, attn, query, key, value, attn_mask=None, key_padding_mask=None):
+        return multi_head_attention(attn, query, key, value, attn_mask, key_padding_mask,
+                                    self.attention_backend, self.attention_chunk_size)
+
     def forward_post(self, tgt, memory,
                      tgt_mask: Optional[Tensor] = None,
                      memory_mask: Optional[Tensor] = None,
@@ -239,15 +296,14 @@ class TransformerDecoderLayer(nn.Module):
         k = self.with_pos_embed(memory, pos)
         v = memory 
  
-        tgt2 = self.self_attn(q, k, v, attn_mask=tgt_mask,
-                              key_padding_mask=tgt_key_padding_mask)[0]
+        tgt2 = self.attend(self.self_attn, q, k, v, attn_mask=tgt_mask,
+                           key_padding_mask=tgt_key_padding_mask)
     
         tgt = tgt + self.dropout1(tgt2)
         tgt = self.norm1(tgt)
-        tgt2 = self.multihead_attn(query=self.with_pos_embed(tgt, query_pos),
-                                   key=self.with_pos_embed(memory, pos),
-                                   value=memory, attn_mask=memory_mask,
-                                   key_padding_mask=memory_key_padding_mask)[0]
+        tgt2 = self.attend(self.multihead_attn, self.with_pos_embed(tgt, query_pos),
+                           self.with_pos_embed(memory, pos), memory, attn_mask=memory_mask,
+                           key_padding_mask=memory_key_padding_mask)
         tgt = tgt + self.dropout2(tgt2)
         tgt = self.norm2(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt))))
@@ -264,15 +320,14 @@ class TransformerDecoderLayer(nn.Module):
                     query_pos: Optional[Tensor] = None):
         tgt2 = self.norm1(tgt)
         q = k = self.with_pos_embed(tgt2, query_pos)
-        tgt2 = self.self_attn(q, k, value=tgt2, attn_mask=tgt_mask,
-                              key_padding_mask=tgt_key_padding_mask)[0]
+        tgt2 = self.attend(self.self_attn, q, k, tgt2, attn_mask=tgt_mask,
+                           key_padding_mask=tgt_key_padding_mask)
 
         tgt = tgt + self.dropout1(tgt2)
         tgt2 = self.norm2(tgt)
-        tgt2 = self.multihead_attn(query=self.with_pos_embed(tgt2, query_pos),
-                                   key=self.with_pos_embed(memory, pos),
-                                   value=memory, attn_mask=memory_mask,
-                                   key_padding_mask=memory_key_padding_mask)[0]
+        tgt2 = self.attend(self.multihead_attn, self.with_pos_embed(tgt2, query_pos),
+                           self.with_pos_embed(memory, pos), memory, attn_mask=memory_mask,
+                           key_padding_mask=memory_key_padding_mask)
 
         tgt = tgt + self.dropout2(tgt2)
         tgt2 = self.norm3(tgt)
@@ -294,6 +349,91 @@ class TransformerDecoderLayer(nn.Module):
                                  tgt_key_padding_mask, memory_key_padding_mask, pos, query_pos)
 
 
+ATTENTION_BACKENDS = ("native", "sdpa", "chunked")
+
+
+def multi_head_attention(attn: nn.MultiheadAttention, query: Tensor, key: Tensor, value: Tensor,
+                         attn_mask: Optional[Tensor] = None,
+                         key_padding_mask: Optional[Tensor] = None,
+                         backend: str = "native", chunk_size: int = 1024) -> Tensor:
+    """ Attention over LxNxE inputs with the weights of an nn.MultiheadAttention.
+
+        "native" calls the module itself. "sdpa" uses F.scaled_dot_product_attention and
+        "chunked" processes chunk_size queries at a time, so neither materializes the full
+        LxS score matrix. Both pack the input projections when query/key/value are the same
+        tensor, and project a key/value broadcast across the batch (stride 0) only once.
+        Masks, dropout during training and separate q/k/v weights fall back to "native".
+        Projections attached as attn.in_proj_int8/attn.out_proj_int8 (dynamic int8 linears,
+        see style_transfer_quantization.py) replace the float in_proj_weight/out_proj.
+    """
+    if (backend == "native" or attn_mask is not None or key_padding_mask is not None
+            or (attn.training and attn.dropout > 0) or not attn._qkv_same_embed_dim):
+        return attn(query, key, value, attn_mask=attn_mask, key_padding_mask=key_padding_mask,
+                    need_weights=False)[0]
+
+    L, N, E = query.shape
+    S = key.shape[0]
+    h = attn.num_heads
+    q, k, v = _in_projection(attn, query, key, value)
+
+    # LxNxE to NxhxLxd
+    q = q.view(L, -1, h, E // h).permute(1, 2, 0, 3)
+    k = k.view(S, -1, h, E // h).permute(1, 2, 0, 3)
+    v = v.view(S, -1, h, E // h).permute(1, 2, 0, 3)
+    if k.shape[0] != N:
+        k = k.expand(N, -1, -1, -1)
+        v = v.expand(N, -1, -1, -1)
+
+    if backend == "sdpa":
+        out = F.scaled_dot_product_attention(q, k, v)
+    else:
+        # query blocks bound the score matrix to chunk_size x S per head
+        out = torch.cat([F.scaled_dot_product_attention(q[:, :, i:i + chunk_size], k, v)
+                         for i in range(0, L, chunk_size)], dim=2)
+
+    # NxhxLxd to LxNxE
+    out = out.permute(2, 0, 1, 3).reshape(L, N, E)
+    out_proj = getattr(attn, "out_proj_int8", None)
+    if out_proj is not None:
+        return out_proj(out)
+    return F.linear(out, attn.out_proj.weight, attn.out_proj.bias)
+
+
+def _in_projection(attn, query, key, value):
+    """ q/k/v projections, packed into one matmul where inputs are shared """
+    w, b = attn.in_proj_weight, attn.in_proj_bias
+    E = query.shape[-1]
+    if b is None:
+        b = w.new_zeros(3 * E)
+
+    # a key/value broadcast over the batch (e.g. one style memory) is projected once
+    if key.shape[1] > 1 and key.stride(1) == 0 and value.stride(1) == 0:
+        key, value = key[:, :1], value[:, :1]
+
+    # int8 linears for the q/k/v rows of in_proj_weight and the packed qk and kv pairs
+    packed = getattr(attn, "in_proj_int8", None)
+    if packed is not None:
+        if query is key:
+            q, k = packed["qk"](query).chunk(2, dim=-1)
+            return q, k, packed["v"](value)
+        q = packed["q"](query)
+        if key is value:
+            k, v = packed["kv"](key).chunk(2, dim=-1)
+            return q, k, v
+        return q, packed["k"](key), packed["v"](value)
+
+    if query is key and key is value:
+        return F.linear(query, w, b).chunk(3, dim=-1)
+    if query is key:
+        q, k = F.linear(query, w[:2 * E], b[:2 * E]).chunk(2, dim=-1)
+        return q, k, F.linear(value, w[2 * E:], b[2 * E:])
+    q = F.linear(query, w[:E], b[:E])
+    if key is value:
+        k, v = F.linear(key, w[E:], b[E:]).chunk(2, dim=-1)
+        return q, k, v
+    return q, F.linear(key, w[E:2 * E], b[E:2 * E]), F.linear(value, w[2 * E:], b[2 * E:])
+
+
 def _get_clones(module, N):
     return nn.ModuleList([copy.deepcopy(module) for i in range(N)])
 
@@ -1,6 +1,7 @@
 import argparse
 from pathlib import Path
 import os
+import sys
 import torch
 import torch.nn as nn
 from PIL import Image
@@ -63,6 +64,10 @@ parser.add_argument('--vgg', type=str, default='./experiments/vgg_normalised.pth
 parser.add_argument('--decoder_path', type=str, default='experiments/decoder_iter_160000.pth')
 parser.add_argument('--Trans_path', type=str, default='experiments/transformer_iter_160000.pth')
 parser.add_argument('--embedding_path', type=str, default='experiments/embedding_iter_160000.pth')
+parser.add_argument('--packed_path', type=str, default='',
+                    help='Packed checkpoint from style_transfer_checkpoint.py; replaces the three .pth files')
+parser.add_argument('--fast_decode', action='store_true',
+                    help='Decode images near the target size and cache them (style_transfer_preprocess.py)')
 
 
 parser.add_argument('--style_interpolation_weights', type=str, default="")
@@ -108,43 +113,45 @@ if not os.path.exists(output_path):
     os.mkdir(output_path)
 
 
-vgg = StyTR.vgg
-vgg.load_state_dict(torch.load(args.vgg))
-vgg = nn.Sequential(*list(vgg.children())[:44])
-
+# network.inference needs no VGG features, so args.vgg is not loaded
 decoder = StyTR.decoder
 Trans = transformer.Transformer()
 embedding = StyTR.PatchEmbed()
 
 decoder.eval()
 Trans.eval()
-vgg.eval()
-from collections import OrderedDict
-new_state_dict = OrderedDict()
-state_dict = torch.load(args.decoder_path)
-for k, v in state_dict.items():
-    #namekey = k[7:] # remove `module.`
-    namekey = k
-    new_state_dict[namekey] = v
-decoder.load_state_dict(new_state_dict)
-
-new_state_dict = OrderedDict()
-state_dict = torch.load(args.Trans_path)
-for k, v in state_dict.items():
-    #namekey = k[7:] # remove `module.`
-    namekey = k
-    new_state_dict[namekey] = v
-Trans.load_state_dict(new_state_dict)
-
-new_state_dict = OrderedDict()
-state_dict = torch.load(args.embedding_path)
-for k, v in state_dict.items():
-    #namekey = k[7:] # remove `module.`
-    namekey = k
-    new_state_dict[namekey] = v
-embedding.load_state_dict(new_state_dict)
-
-network = StyTR.StyTrans(vgg,decoder,embedding,Trans,args)
+if args.packed_path:
+    # One memory-mapped file instead of three torch.load copies
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from style_transfer_checkpoint import PackedCheckpoint
+    PackedCheckpoint(args.packed_path).load_into({'decoder': decoder, 'transformer': Trans, 'embedding': embedding})
+else:
+    from collections import OrderedDict
+    new_state_dict = OrderedDict()
+    state_dict = torch.load(args.decoder_path)
+    for k, v in state_dict.items():
+        #namekey = k[7:] # remove `module.`
+        namekey = k
+        new_state_dict[namekey] = v
+    decoder.load_state_dict(new_state_dict)
+
+    new_state_dict = OrderedDict()
+    state_dict = torch.load(args.Trans_path)
+    for k, v in state_dict.items():
+        #namekey = k[7:] # remove `module.`
+        namekey = k
+        new_state_dict[namekey] = v
+    Trans.load_state_dict(new_state_dict)
+
+    new_state_dict = OrderedDict()
+    state_dict = torch.load(args.embedding_path)
+    for k, v in state_dict.items():
+        #namekey = k[7:] # remove `module.`
+        namekey = k
+        new_state_dict[namekey] = v
+    embedding.load_state_dict(new_state_dict)
+
+network = StyTR.StyTrans(None,decoder,embedding,Trans,args)
 network.eval()
 network.to(device)
 
@@ -153,24 +160,36 @@ network.to(device)
 content_tf = test_transform(content_size, crop)
 style_tf = test_transform(style_size, crop)
 
+if args.fast_decode:
+    # JPEG draft decoding, uint8 resizing, and every content decoded once for all styles
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from style_transfer_preprocess import ImageLoader
+    images = ImageLoader()
+    content_crop = transforms.CenterCrop(content_size) if crop else nn.Identity()
+    style_crop = transforms.CenterCrop(style_size) if crop else nn.Identity()
+    load_content = lambda path: content_crop(images.load(path, content_size))
+    load_style = lambda path: style_crop(images.load(path, style_size))
+else:
+    load_content = lambda path: content_tf(Image.open(path).convert("RGB"))
+    load_style = lambda path: style_tf(Image.open(path).convert("RGB"))
+
 for content_path in content_paths:
     for style_path in style_paths:
         print(content_path)
        
       
         content_tf1 = content_transform()       
-        content = content_tf(Image.open(content_path).convert("RGB"))
+        content = load_content(content_path)
 
         h,w,c=np.shape(content)    
         style_tf1 = style_transform(h,w)
-        style = style_tf(Image.open(style_path).convert("RGB"))
+        style = load_style(style_path)
 
       
         style = style.to(device).unsqueeze(0)
         content = content.to(device).unsqueeze(0)
         
-        with torch.no_grad():
-            output= network(content,style)       
+        output= network.inference(content,style)
         output = output.cpu()
                 
         output_name = '{:s}/{:s}_stylized_{:s}{:s}'.format(
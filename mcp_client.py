@@ -22,7 +22,15 @@ async def run_style_transfer_client():
 
     try:
         async with stdio_client(server_params) as (read_stream, write_stream):
-            async with ClientSession(read_stream, write_stream) as session:
+            async def log_server_message(params: types.LoggingMessageNotificationParams):
+                # Progress messages of apply_style_transfer_batch
+                logger.info(f"[server] {params.data}")
+
+            async def log_progress(progress: float, total: float | None, message: str | None):
+                # Requesting progress gives the call a progressToken, without which the server's reports are dropped
+                logger.info(f"[progress] {progress:g}/{total:g}" if total else f"[progress] {progress:g}")
+
+            async with ClientSession(read_stream, write_stream, logging_callback=log_server_message) as session:
                 await session.initialize()
                 logger.info("Successfully connected to Style Transfer MCP server.")
 
@@ -48,6 +56,31 @@ async def run_style_transfer_client():
                     "/home/ohya-bob/Documents/mcp/agent/StyTR-2/demo/s_img/LevelSequence_Vaihingen.0002.png"
                 ]
 
+                # One call for all styles: each style is encoded once and progress is logged as items finish
+                tool_to_call_batch = "apply_style_transfer_batch"
+                if tool_to_call_batch in available_tools:
+                    tool_to_call = tool_to_call_batch
+                    batch_payload = {
+                        "content_image_paths": [content_image_to_use],
+                        "style_image_paths": style_images_to_use,
+                        "alpha": 0.8,
+                    }
+                    logger.info(f"Parameters for calling tool '{tool_to_call}': {batch_payload}")
+                    result = await session.call_tool(tool_to_call, arguments={"request": batch_payload},
+                                                     progress_callback=log_progress)
+                    
+                    if result.isError:
+                        error_message = "Unknown error"
+                        if result.content and isinstance(result.content, list) and len(result.content) > 0 and hasattr(result.content[0], 'text'):
+                            error_message = result.content[0].text
+                        logger.error(f"Error calling tool '{tool_to_call}': {error_message}")
+                    else:
+                        logger.info(f"Tool '{tool_to_call}' called successfully!")
+                        for content_item in result.content:
+                            if content_item.type == "text":
+                                logger.info(f"  Manifest: {content_item.text}")
+                    style_images_to_use = []  # Already processed by the batch tool
+                
                 for style_image_path in style_images_to_use:
                     logger.info(f"--- Processing style image: {style_image_path} ---")
                     style_transfer_payload = {
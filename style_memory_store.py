@@ -0,0 +1,142 @@
+"""
+Style Memory Store
+Caches the PatchEmbed + encoder_s output of StyTR-2 for each style image,
+so repeated requests with the same style skip the whole style branch
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import torch
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_fingerprint(*paths: str) -> str:
+    """
+    Identify a set of checkpoint files by path, size and modification time.
+
+    Cheap enough for every cold start, and identical for all server processes
+    on a host that read the same files.
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        h.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return h.hexdigest()[:16]
+
+
+# File content hashes memoized on (path, size, mtime), shared by all caches in the process
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """Content hash of a file, memoized on (path, size, mtime)"""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with _digests_lock:
+            _digests[memo_key] = digest
+    return digest
+
+
+class StyleMemoryStore:
+    """
+    Two-level cache of style memories (encoder_s outputs, HWxNxC tensors).
+
+    Entries are keyed by the style image content hash, the preprocessing
+    resolution and the checkpoint fingerprint. They are saved as tensor files
+    in ``cache_dir`` and loaded memory-mapped, so several server processes
+    share the same pages. An in-process LRU of ``capacity`` entries sits in
+    front of the disk.
+    """
+
+    def __init__(self, cache_dir: str, checkpoint: str, capacity: int = 32):
+        self.cache_dir = cache_dir
+        self.checkpoint = checkpoint
+        self.capacity = capacity
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, style_path: str, size: int) -> str:
+        """Cache key for a style image preprocessed at the given resolution"""
+        return f"{file_digest(style_path)[:32]}_{size}_{self.checkpoint}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def _remember(self, key: str, memory: torch.Tensor):
+        with self._lock:
+            self._lru[key] = memory
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        """Return the cached style memory for a key, or None"""
+        with self._lock:
+            memory = self._lru.get(key)
+            if memory is not None:
+                self._lru.move_to_end(key)
+                return memory
+
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            memory = torch.load(path, mmap=True, weights_only=True)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable style memory {path}: {str(e)}")
+            return None
+        self._remember(key, memory)
+        return memory
+
+    def put(self, key: str, memory: torch.Tensor):
+        """Persist a style memory; the file is written atomically so concurrent processes never see partial data"""
+        memory = memory.detach().cpu().contiguous()
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            torch.save(memory, tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._remember(key, memory)
+
+    def get_or_compute(self, style_path: str, size: int, compute: Callable[[], torch.Tensor]) -> torch.Tensor:
+        """
+        Look up the style memory for an image, computing and storing it on a miss
+
+        Args:
+            style_path: Path to the style image
+            size: Preprocessing resolution the memory was computed at
+            compute: Callable returning the encoder_s output for the image
+
+        Returns:
+            The style memory tensor (on CPU)
+        """
+        key = self.key(style_path, size)
+        memory = self.get(key)
+        if memory is None:
+            logger.info(f"Style memory miss for {os.path.basename(style_path)}, encoding style")
+            memory = compute()
+            self.put(key, memory)
+        return memory
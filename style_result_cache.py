@@ -0,0 +1,188 @@
+"""
+Style Result Cache
+Content-addressed cache of stylized output files. Keys hash the content and
+style image bytes together with every option that changes the output, so a
+repeated request is answered from the stored file instead of running the
+network, whether or not it asks for an output file. The directory is kept under a byte budget by evicting the
+least recently used entries.
+"""
+
+import os
+import glob
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Optional
+
+from PIL import Image
+
+from style_memory_store import file_digest
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Stylized outputs on disk, bounded to max_bytes with LRU eviction
+
+    Entries are files named by key and the extension of the output they were
+    stored from (PNG for outputs without a file) in cache_dir; their
+    modification time is refreshed on every hit and serves as the LRU order,
+    so several processes can share one directory.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, content_path: str, style_path: str, **options) -> str:
+        """
+        Cache key for a content/style pair
+
+        Args:
+            content_path: Path to the content image
+            style_path: Path to the style image
+            options: Everything else that changes the output, e.g. alpha,
+                resolution, checkpoint id and engine options
+        """
+        h = hashlib.sha256()
+        h.update(file_digest(content_path).encode())
+        h.update(file_digest(style_path).encode())
+        h.update(repr(sorted(options.items())).encode())
+        return h.hexdigest()[:40]
+
+    def _path(self, key: str, output_path: str) -> str:
+        ext = os.path.splitext(output_path)[1].lower() or '.jpg'
+        return os.path.join(self.cache_dir, f"{key}{ext}")
+
+    def _entry(self, key: str) -> Optional[str]:
+        """Path of the stored file for key, whatever its extension"""
+        for path in glob.glob(os.path.join(self.cache_dir, f"{key}.*")):
+            if not path.endswith('.tmp'):
+                return path
+        return None
+
+    def fetch(self, key: str, output_path: Optional[str] = None) -> Optional[str]:
+        """
+        Look up key; None on a miss
+
+        Returns the path of the cached file, which may be evicted at any
+        time. With output_path the output is also placed there, converted
+        when its format differs from the stored one.
+        """
+        path = self._entry(key)
+        try:
+            if path is None:
+                raise FileNotFoundError(key)
+            os.utime(path)
+            if output_path:
+                output_dir = os.path.dirname(output_path)
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+                if os.path.splitext(path)[1] == (os.path.splitext(output_path)[1].lower() or '.jpg'):
+                    _copy(path, output_path)
+                else:
+                    _convert(path, output_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, key: str, output_path: str):
+        """Store a freshly written output file under key, then evict down to the byte budget"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(output_path, tmp_path)
+            os.replace(tmp_path, self._path(key, output_path))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._evict()
+
+    def put_image(self, key: str, image: Image.Image):
+        """Store an output that was not written to a file, as PNG"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            # Fast compression: entries are written once per miss and read back on every hit
+            image.save(tmp_path, format='PNG', compress_level=1)
+            os.replace(tmp_path, os.path.join(self.cache_dir, f"{key}.png"))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self) -> dict:
+        """Hit/miss counts of this process and the current size of the directory"""
+        sizes = [entry.stat().st_size for entry in os.scandir(self.cache_dir)
+                 if entry.is_file() and not entry.name.endswith('.tmp')]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(sizes),
+            "bytes": sum(sizes),
+            "max_bytes": self.max_bytes,
+        }
+
+
+def _convert(source: str, destination: str):
+    """Atomically write the image in source to destination in the format of its extension"""
+    tmp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with Image.open(source) as image:
+            image.convert('RGB').save(tmp_path, format=Image.registered_extensions().get(
+                os.path.splitext(destination)[1].lower(), 'JPEG'))
+        os.replace(tmp_path, destination)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _copy(source: str, destination: str):
+    """
+    Atomically copy source to destination
+
+    A hard link would be cheaper, but a later save to the same output path
+    truncates the file in place and would overwrite the cached entry with it.
+    """
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return
+    tmp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
@@ -0,0 +1,76 @@
+"""
+Admission control for the MCP server
+Bounds the number of stylization requests the server accepts: up to
+max_in_flight run at once (the size of the inference executor) and up to
+max_queued wait behind them. Anything beyond that is rejected immediately
+with a retry-after estimate instead of piling up unbounded work.
+"""
+
+import math
+import logging
+from contextlib import asynccontextmanager
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class ServerBusy(Exception):
+    """Raised when the admission queue is full"""
+
+    def __init__(self, retry_after: float, admitted: int):
+        super().__init__(f"Server busy with {admitted} requests, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.admitted = admitted
+
+
+class AdmissionQueue:
+    """
+    Counts admitted requests and turns away those beyond max_in_flight + max_queued
+
+    The executor that runs the admitted requests bounds how many run at once;
+    this only decides admission and estimates when to retry.
+
+    Args:
+        max_in_flight: Requests that run at the same time
+        max_queued: Requests allowed to wait for a running slot
+        initial_seconds: Run time assumed for retry-after before any request finished
+    """
+
+    def __init__(self, max_in_flight: int = 1, max_queued: int = 16, initial_seconds: float = 5.0):
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight should be at least 1, not {max_in_flight}")
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.admitted = 0
+        self.rejected = 0
+        self.mean_seconds = initial_seconds
+
+    def observe(self, seconds: float):
+        """Record how long one request ran, excluding its time in the queue"""
+        self.mean_seconds = 0.8 * self.mean_seconds + 0.2 * seconds
+
+    def retry_after(self) -> float:
+        """Seconds until the queue is likely to have room, from the mean run time"""
+        waves = math.ceil((self.admitted + 1 - self.max_in_flight) / self.max_in_flight)
+        return round(max(waves, 1) * self.mean_seconds, 1)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Admit the body, or raise ServerBusy when the queue is full"""
+        if self.admitted >= self.max_in_flight + self.max_queued:
+            self.rejected += 1
+            raise ServerBusy(self.retry_after(), self.admitted)
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.admitted -= 1
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "rejected": self.rejected,
+            "mean_seconds": round(self.mean_seconds, 2),
+        }
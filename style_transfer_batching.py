@@ -0,0 +1,95 @@
+"""
+Micro-batching for concurrent stylization requests
+Requests that arrive within a short window and share a batch key (same
+style and options) are run as one batched call, and each caller gets its
+own result back. Latency grows by at most the window; throughput grows
+with the batch size.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects items per key for up to window seconds or max_batch items, then runs them together
+
+    Args:
+        run_batch: Coroutine taking (key, items) and returning one result per item, in order;
+            an exception instance in place of a result fails only that item
+        window: Seconds to wait for more items after the first item of a batch arrives
+        max_batch: A batch is dispatched as soon as it holds this many items
+    """
+
+    def __init__(self, run_batch: Callable[[Hashable, List[Any]], Awaitable[List[Any]]],
+                 window: float = 0.02, max_batch: int = 8):
+        if max_batch < 1:
+            raise ValueError(f"max_batch should be at least 1, not {max_batch}")
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self.batches = 0
+        self.items = 0
+        self.retried = 0
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        """Queue an item under key and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        group = self._pending.setdefault(key, [])
+        group.append((item, future))
+        if len(group) >= self.max_batch:
+            self._dispatch(key)
+        elif len(group) == 1:
+            self._timers[key] = loop.call_later(self.window, self._dispatch, key)
+        return await future
+
+    def _dispatch(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        group = self._pending.pop(key, None)
+        if group:
+            asyncio.ensure_future(self._run(key, group))
+
+    async def _run(self, key: Hashable, group: List[Tuple[Any, asyncio.Future]]):
+        self.batches += 1
+        self.items += len(group)
+        try:
+            results = await self.run_batch(key, [item for item, _ in group])
+        except Exception as e:
+            if len(group) == 1:
+                results = [e]
+            else:
+                # One bad item must not fail the others: run every item on its own
+                logger.warning(f"Batch of {len(group)} failed ({str(e)}), retrying its items one by one")
+                self.retried += len(group)
+                results = [await self._run_one(key, item) for item, _ in group]
+        for (_, future), result in zip(group, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _run_one(self, key: Hashable, item: Any) -> Any:
+        try:
+            return (await self.run_batch(key, [item]))[0]
+        except Exception as e:
+            return e
+
+    def stats(self) -> dict:
+        """Batches run, mean items per batch and items retried alone after their batch failed"""
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "retried": self.retried,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,234 @@
+"""
+Packed StyTR-2 checkpoints
+Packs the decoder, transformer and embedding state dicts into one file in
+the safetensors layout (8-byte header length, JSON header, raw tensor data),
+optionally stored as fp16. The file is memory-mapped and tensors are
+materialized lazily as views of the mapping, so a cold start reads only the
+pages it touches and processes on a host share them through the page cache.
+
+Run this module directly to pack the default checkpoints:
+
+    python style_transfer_checkpoint.py --dtype fp16
+"""
+
+import os
+import json
+import mmap
+import struct
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Optional
+
+import torch
+import torch.nn as nn
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Storage dtypes of a packed file; weights are used as float32 either way
+CHECKPOINT_DTYPES = {'fp32': torch.float32, 'fp16': torch.float16}
+
+# safetensors dtype names
+_DTYPE_NAMES = {torch.float32: 'F32', torch.float16: 'F16', torch.bfloat16: 'BF16', torch.int64: 'I64'}
+_NAME_DTYPES = {name: dtype for dtype, name in _DTYPE_NAMES.items()}
+
+# Tensor data starts on this boundary so every view is aligned
+_ALIGNMENT = 64
+
+# The modules of StyTrans stored in a packed file, by key prefix
+COMPONENTS = ('decoder', 'transformer', 'embedding')
+
+
+def packed_path(cache_dir: str, checkpoint: str, dtype: str = 'fp32') -> str:
+    """Packed file for a checkpoint fingerprint and storage dtype"""
+    return os.path.join(cache_dir, f"stytr2_{checkpoint}_{dtype}.safetensors")
+
+
+def pack_state_dicts(state_dicts: Dict[str, Dict[str, torch.Tensor]], path: str, dtype: str = 'fp32',
+                     metadata: Optional[Dict[str, str]] = None):
+    """
+    Write state dicts to one packed file, atomically
+
+    Args:
+        state_dicts: State dict per component, e.g. {'decoder': ..., 'transformer': ..., 'embedding': ...}
+        path: Output file
+        dtype: "fp32" or "fp16" storage for floating point tensors
+        metadata: Extra string metadata stored in the header
+    """
+    storage = CHECKPOINT_DTYPES[dtype]
+    tensors = {}
+    for component, state_dict in state_dicts.items():
+        for name, tensor in state_dict.items():
+            tensor = tensor.detach().cpu()
+            if tensor.is_floating_point():
+                tensor = tensor.to(storage)
+            tensors[f"{component}.{name}"] = tensor.contiguous()
+
+    header = {'__metadata__': dict(metadata or {}, dtype=dtype)}
+    offset = 0
+    for name, tensor in tensors.items():
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {'dtype': _DTYPE_NAMES[tensor.dtype], 'shape': list(tensor.shape),
+                        'data_offsets': [offset, offset + size]}
+        # Pad between tensors so each one starts aligned
+        offset += size + (-size) % _ALIGNMENT
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    header_bytes += b' ' * ((-(8 + len(header_bytes))) % _ALIGNMENT)
+
+    output_dir = os.path.dirname(path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for name, tensor in tensors.items():
+                start, end = header[name]['data_offsets']
+                f.seek(8 + len(header_bytes) + start)
+                f.write(tensor.numpy().tobytes() if tensor.dtype != torch.bfloat16
+                        else tensor.view(torch.int16).numpy().tobytes())
+            f.truncate(8 + len(header_bytes) + offset)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class PackedCheckpoint:
+    """
+    Read-only view of a packed file
+
+    The file is mapped copy-on-write: tensors returned by tensor() share the
+    page cache until written to, and nothing is read from disk before a
+    tensor's pages are touched.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            header_size = struct.unpack('<Q', f.read(8))[0]
+            header = json.loads(f.read(header_size))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.metadata = header.pop('__metadata__', {})
+        self._entries = header
+        self._data_start = 8 + header_size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def prefetch(self):
+        """Ask the kernel to read the whole file ahead in the background"""
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            self._mmap.madvise(mmap.MADV_WILLNEED)
+
+    def tensor(self, name: str) -> torch.Tensor:
+        """Zero-copy tensor backed by the mapping"""
+        entry = self._entries[name]
+        dtype = _NAME_DTYPES[entry['dtype']]
+        start, end = entry['data_offsets']
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            return torch.empty(entry['shape'], dtype=dtype)
+        return torch.frombuffer(self._mmap, dtype=dtype, count=count,
+                                offset=self._data_start + start).view(entry['shape'])
+
+    def state_dict(self, component: str, dtype: torch.dtype = torch.float32,
+                   executor: Optional[ThreadPoolExecutor] = None) -> Dict[str, torch.Tensor]:
+        """
+        State dict of one component
+
+        Floating point tensors stored in another dtype are converted to dtype,
+        in parallel on executor when one is given; the others stay zero-copy.
+        """
+        prefix = f"{component}."
+        names = [name for name in self._entries if name.startswith(prefix)]
+
+        def materialize(name):
+            tensor = self.tensor(name)
+            if tensor.is_floating_point() and tensor.dtype != dtype:
+                tensor = tensor.to(dtype)
+            return tensor
+
+        tensors = executor.map(materialize, names) if executor else map(materialize, names)
+        return {name[len(prefix):]: tensor for name, tensor in zip(names, tensors)}
+
+    def load_into(self, modules: Dict[str, nn.Module], num_threads: int = 4):
+        """
+        Load components into modules, e.g. {'decoder': decoder, 'transformer': Trans, 'embedding': embedding}
+
+        Parameters are assigned rather than copied, so fp32 files keep the
+        weights in the shared mapping instead of a private copy.
+        """
+        self.prefetch()
+        with ThreadPoolExecutor(max_workers=max(num_threads, 1)) as executor:
+            for component, module in modules.items():
+                module.load_state_dict(self.state_dict(component, executor=executor), assign=True)
+
+
+_pack_lock = threading.Lock()
+
+
+def load_or_pack(modules: Dict[str, nn.Module], checkpoint_paths: Dict[str, str], cache_dir: str,
+                 checkpoint: str, dtype: str = 'fp32', num_threads: int = 4) -> str:
+    """
+    Load components from the packed file for a checkpoint, packing the .pth files once on a miss
+
+    Args:
+        modules: Module per component, loaded in place
+        checkpoint_paths: .pth file per component
+        cache_dir: Directory of packed files
+        checkpoint: Fingerprint of the .pth files
+        dtype: "fp32" or "fp16" storage
+        num_threads: Threads used to read .pth files or convert fp16 tensors
+
+    Returns:
+        Path of the packed file
+    """
+    if dtype not in CHECKPOINT_DTYPES:
+        raise ValueError(f"checkpoint dtype should be one of {tuple(CHECKPOINT_DTYPES)}, not {dtype}")
+    path = packed_path(cache_dir, checkpoint, dtype)
+    if os.path.exists(path):
+        try:
+            PackedCheckpoint(path).load_into(modules, num_threads)
+            return path
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable packed checkpoint {path}: {str(e)}")
+
+    # Miss: read the separate checkpoints in parallel, then pack them for the next cold start
+    with ThreadPoolExecutor(max_workers=max(num_threads, 1)) as executor:
+        state_dicts = dict(zip(checkpoint_paths, executor.map(
+            lambda p: torch.load(p, map_location='cpu'), checkpoint_paths.values())))
+    with _pack_lock:
+        logger.info(f"Packing StyTR-2 checkpoints into {path}")
+        pack_state_dicts(state_dicts, path, dtype, {'checkpoint': checkpoint})
+    PackedCheckpoint(path).load_into(modules, num_threads)
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+    from style_memory_store import checkpoint_fingerprint
+
+    model_dir = os.path.join(os.path.dirname(__file__), 'StyTR-2', 'experiments')
+    parser = argparse.ArgumentParser(description="Pack the StyTR-2 checkpoints into one memory-mappable file")
+    parser.add_argument('--decoder', default=os.path.join(model_dir, 'decoder_iter_160000.pth'))
+    parser.add_argument('--transformer', default=os.path.join(model_dir, 'transformer_iter_160000.pth'))
+    parser.add_argument('--embedding', default=os.path.join(model_dir, 'embedding_iter_160000.pth'))
+    parser.add_argument('--dtype', choices=tuple(CHECKPOINT_DTYPES), default='fp32')
+    parser.add_argument('--output-dir', default=os.path.join(model_dir, 'packed'))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    paths = {'decoder': args.decoder, 'transformer': args.transformer, 'embedding': args.embedding}
+    checkpoint = checkpoint_fingerprint(*paths.values())
+    output_path = packed_path(args.output_dir, checkpoint, args.dtype)
+    pack_state_dicts({component: torch.load(path, map_location='cpu') for component, path in paths.items()},
+                     output_path, args.dtype, {'checkpoint': checkpoint})
+    print(output_path)
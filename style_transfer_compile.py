@@ -0,0 +1,198 @@
+"""
+Compiled StyTR-2 inference graphs
+Compiles the stylization graph (embedding, content encoder, cross-attention
+decoder and CNN decoder over a precomputed style memory) and keeps the
+artifacts on disk, so restarted processes reuse them instead of compiling
+again. Traced graphs record tensor sizes as graph operations, so one graph
+serves every resolution and style token count; only the Python branches of
+the attention backends are specialized, which keeps the number of graphs
+per checkpoint small.
+"""
+
+import os
+import glob
+import math
+import logging
+import tempfile
+import threading
+import warnings
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# "torchscript": traced graphs sharing the module parameters, reloaded in milliseconds
+# "inductor": torch.compile kernels with dynamic shapes, warm-started from saved compiler cache artifacts
+COMPILE_BACKENDS = ('torchscript', 'inductor')
+
+
+class StylizeGraph(nn.Module):
+    """Same computation as StyTrans.inference_batch, as a plain forward that can be traced or compiled"""
+
+    def __init__(self, network: nn.Module):
+        super().__init__()
+        self.embedding = network.embedding
+        self.transformer = network.transformer
+        self.decode = network.decode
+
+    def forward(self, content: torch.Tensor, style_memory: torch.Tensor) -> torch.Tensor:
+        content = self.embedding(content)
+        memory_c, pos_embed_c = self.transformer.encode_content(content)
+        style_memory = style_memory.expand(-1, content.shape[0], -1)
+        hs = self.transformer.decode(memory_c, style_memory, pos_embed_c, content.shape[-2:])
+        return self.decode(hs)
+
+
+class CompiledStylizer:
+    """
+    Callable with the signature of StyTrans.inference_batch(content, style_memory=...)
+
+    Graphs are built lazily for each bucket (see bucket()) and cached in
+    cache_dir under the given key, which must identify the checkpoint and
+    every option that changes the graph. At most max_graphs graphs are kept
+    in memory and the artifacts of this backend in cache_dir are kept under
+    max_bytes, evicting the least recently used ones.
+    """
+
+    def __init__(self, network: nn.Module, backend: str, cache_dir: str, key: str,
+                 max_graphs: int = 8, max_bytes: int = 1024 * 1024 * 1024):
+        if backend not in COMPILE_BACKENDS:
+            raise ValueError(f"compile backend should be one of {COMPILE_BACKENDS}, not {backend}")
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.key = key
+        self.max_graphs = max_graphs
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.graph = StylizeGraph(network).eval()
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Sizes of the Python loop over query chunks, the only shape the chunked backend specializes
+        layers = [m for m in network.transformer.modules() if hasattr(m, 'attention_backend')]
+        self._chunk_size = None
+        if any(layer.attention_backend == 'chunked' for layer in layers):
+            self._chunk_size = min(layer.attention_chunk_size for layer in layers)
+        self._patch_size = network.embedding.proj.stride[0]
+
+        if backend == 'inductor':
+            for path in glob.glob(os.path.join(cache_dir, f"inductor_{key}_*.bin")):
+                with open(path, 'rb') as f:
+                    torch.compiler.load_cache_artifacts(f.read())
+            self._compiled = torch.compile(self.graph, dynamic=True)
+
+    def bucket(self, content: torch.Tensor, style_memory: torch.Tensor) -> str:
+        """
+        Name of the graph serving these inputs
+
+        Traced sizes are dynamic, so only the Python branches taken while
+        tracing tell graphs apart: whether the style memory is broadcast over
+        a batch (its projection is shared) and, for the chunked attention
+        backend, the number of query chunks.
+        """
+        bucket = 'batch' if content.shape[0] > 1 else 'single'
+        if self._chunk_size is not None:
+            tokens = (content.shape[-2] // self._patch_size) * (content.shape[-1] // self._patch_size)
+            bucket += f"_c{math.ceil(tokens / self._chunk_size)}"
+        return bucket
+
+    def _path(self, bucket: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, f"{self.backend}_{self.key}_{bucket}{ext}")
+
+    def _save(self, path: str, write):
+        """Write an artifact atomically so concurrent processes never load partial files"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _evict(self):
+        """Keep the artifacts of this backend in cache_dir under max_bytes"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.startswith(f"{self.backend}_") and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _share_parameters(self, graph):
+        """Point a loaded graph at the parameters and buffers of the live network instead of its own copies"""
+        tensors = dict(self.graph.named_parameters())
+        tensors.update(self.graph.named_buffers())
+        for name, _ in list(graph.named_parameters()) + list(graph.named_buffers()):
+            if name not in tensors:
+                continue
+            *path, attr = name.split('.')
+            owner = graph
+            for part in path:
+                owner = getattr(owner, part)
+            setattr(owner, attr, tensors[name])
+
+    def _build_torchscript(self, bucket: str, content: torch.Tensor, style_memory: torch.Tensor):
+        path = self._path(bucket, '.pt')
+        with warnings.catch_warnings():
+            # Shape-dependent Python branches are expected to be specialized per bucket
+            warnings.simplefilter('ignore', torch.jit.TracerWarning)
+            warnings.simplefilter('ignore', FutureWarning)
+            if os.path.exists(path):
+                try:
+                    graph = torch.jit.load(path, map_location=content.device)
+                    self._share_parameters(graph)
+                    os.utime(path)
+                    return graph
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable compiled graph {path}: {str(e)}")
+
+            logger.info(f"Tracing stylization graph for bucket {bucket}")
+            # Not frozen: the graph keeps referencing the module parameters instead of inlining a copy of the weights
+            with torch.no_grad():
+                graph = torch.jit.trace(self.graph, (content.clone(), style_memory.clone()), check_trace=False)
+            self._save(path, lambda tmp_path: torch.jit.save(graph, tmp_path))
+        self._evict()
+        return graph
+
+    def _build_inductor(self, bucket: str, content: torch.Tensor, style_memory: torch.Tensor):
+        logger.info(f"Compiling stylization graph for bucket {bucket}")
+        with torch.no_grad():
+            self._compiled(content, style_memory)
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is not None:
+            data = artifacts[0]
+
+            def write(tmp_path):
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+            self._save(self._path(bucket, '.bin'), write)
+            self._evict()
+        return self._compiled
+
+    def __call__(self, content: torch.Tensor, style_memory: torch.Tensor = None) -> torch.Tensor:
+        bucket = self.bucket(content, style_memory)
+        with self._lock:
+            graph = self._graphs.get(bucket)
+            if graph is None:
+                build = self._build_inductor if self.backend == 'inductor' else self._build_torchscript
+                graph = self._graphs[bucket] = build(bucket, content, style_memory)
+                while len(self._graphs) > self.max_graphs:
+                    self._graphs.popitem(last=False)
+            else:
+                self._graphs.move_to_end(bucket)
+        with torch.inference_mode():
+            return graph(content, style_memory)
@@ -5,27 +5,29 @@ This MCP server provides style transfer functionality using StyTR-2
 
 import os
 import sys
+import time
+import asyncio
 import logging
-from typing import Optional
+import threading
+from functools import partial
+from typing import Annotated, List, Literal, NamedTuple, Optional, Tuple, Union
 from pydantic import BaseModel, Field
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP, Image as MCPImage
 import torch
-import numpy as np
 from PIL import Image
 import base64
 from io import BytesIO
-from torchvision import transforms
-from torchvision.utils import save_image
 
 # Add StyTR-2 to path
 STYTR2_PATH = os.path.join(os.path.dirname(__file__), 'StyTR-2')
 sys.path.insert(0, STYTR2_PATH)
 
-# Import StyTR-2 modules
-import models.StyTR as StyTR
-import models.transformer as transformer
-from collections import OrderedDict
-import torch.nn as nn
+from style_transfer_tool import StyleTransferTool, alpha_output_path, tool_options_from_env, trim_to_patches
+from style_transfer_workers import WorkerPool
+from style_transfer_batching import MicroBatcher
+from style_transfer_admission import AdmissionQueue, ServerBusy
+from style_transfer_singleflight import SingleFlight
+from concurrent.futures import ThreadPoolExecutor
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -34,33 +36,94 @@ logger = logging.getLogger(__name__)
 # Create MCP server
 mcp = FastMCP("Style Transfer Server")
 
-# Define test_transform function (from StyTR-2 test.py)
-def test_transform(size, crop=False):
-    transform_list = []
-    if size != 0: 
-        transform_list.append(transforms.Resize(size))
-    if crop:
-        transform_list.append(transforms.CenterCrop(size))
-    transform_list.append(transforms.ToTensor())
-    transform = transforms.Compose(transform_list)
-    return transform
+# PIL format names of the encodings a stylized image can be returned in
+IMAGE_FORMATS = {'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+class ImageEncoding(NamedTuple):
+    """How a stylized image is encoded for the response"""
+    format: str = 'jpeg'
+    quality: int = 90
+    preview_size: Optional[int] = None
+
+def encode_image(image: Image.Image, encoding: ImageEncoding) -> bytes:
+    """Encode in memory, downscaled so the long side is at most preview_size when set"""
+    if encoding.preview_size and max(image.size) > encoding.preview_size:
+        image = image.copy()
+        image.thumbnail((encoding.preview_size, encoding.preview_size), Image.BILINEAR)
+    buffer = BytesIO()
+    image.save(buffer, format=IMAGE_FORMATS[encoding.format], quality=encoding.quality)
+    return buffer.getvalue()
 
 class StyleTransferRequest(BaseModel):
     """Request model for style transfer"""
-    content_image_path: str = Field(description="Path to the content image")
+    content_image_path: Union[str, List[str]] = Field(description="Path to the content image, or a list of paths stylized with the same style in batched forwards")
     style_image_path: str = Field(description="Path to the style image")
-    output_path: Optional[str] = Field(default=None, description="Path for output image")
-    alpha: float = Field(default=1.0, description="Style weight (0-1)")
+    output_path: Optional[Union[str, List[str]]] = Field(default=None, description="Path for output image (a list with one path per content image for batches)")
+    alpha: Union[float, Annotated[List[float], Field(min_length=1)]] = Field(default=1.0, description="Style weight (0-1), or a list of weights (e.g. [0.25, 0.5, 0.75, 1.0]) all produced from one stylization of a single content image")
+    alpha_blend: Literal['pixel', 'feature'] = Field(default='pixel', description="How weights below 1 are applied: 'pixel' blends the output with the content image, 'feature' interpolates the network features (single content image, not with tile_size)")
     return_base64: bool = Field(default=False, description="Return result as base64 encoded image")
+    return_image: bool = Field(default=False, description="Return result as MCP image content alongside the JSON response")
+    image_format: Literal['jpeg', 'png', 'webp'] = Field(default='jpeg', description="Encoding of returned images")
+    image_quality: int = Field(default=90, ge=1, le=100, description="JPEG/WebP quality (1-100) of returned images")
+    preview_size: Optional[int] = Field(default=None, ge=1, description="Downscale returned images so the long side is at most this many pixels; saved files keep full resolution")
+    tile_size: Optional[int] = Field(default=None, ge=8, description="Stylize at native resolution in overlapping tiles of this size (pixels) instead of resizing to 512. Use for large images")
+    overlap: int = Field(default=64, ge=0, description="Overlap in pixels between neighbouring tiles when tile_size is set, smaller than tile_size")
+    style_tokens: Optional[int] = Field(default=None, ge=1, description="Quality/speed knob: pool the style to this many tokens (e.g. 256) for faster decoding. None keeps all style tokens")
+    
+    def encoding(self) -> Optional[ImageEncoding]:
+        """Encoding of the returned image, or None when no image is returned"""
+        if not (self.return_base64 or self.return_image):
+            return None
+        return ImageEncoding(self.image_format, self.image_quality, self.preview_size)
 
 class StyleTransferResponse(BaseModel):
     """Response model for style transfer"""
     output_path: Optional[str] = Field(description="Path to output image if saved")
     base64_image: Optional[str] = Field(description="Base64 encoded image if requested")
+    output_paths: Optional[List[Optional[str]]] = Field(default=None, description="Paths to output images for batch requests and alpha lists")
+    base64_images: Optional[List[str]] = Field(default=None, description="Base64 encoded images for batch requests and alpha lists if requested")
+    message: str = Field(description="Status message")
+    retry_after: Optional[float] = Field(default=None, description="Seconds to wait before retrying when the server is busy")
+
+class StylePair(BaseModel):
+    """One content/style pair of a batch request"""
+    content_image_path: str = Field(description="Path to the content image")
+    style_image_path: str = Field(description="Path to the style image")
+    output_path: Optional[str] = Field(default=None, description="Path for the output image. Generated in output_dir if not provided")
+
+class StyleTransferBatchRequest(BaseModel):
+    """Request model for batch style transfer"""
+    pairs: Optional[List[StylePair]] = Field(default=None, description="Explicit content/style pairs")
+    content_image_paths: Optional[List[str]] = Field(default=None, description="Content images, crossed with style_image_paths (every content with every style)")
+    style_image_paths: Optional[List[str]] = Field(default=None, description="Style images, crossed with content_image_paths")
+    output_dir: str = Field(default="output", description="Directory for outputs without an explicit output_path")
+    alpha: float = Field(default=1.0, description="Style weight (0-1)")
+    tile_size: Optional[int] = Field(default=None, ge=8, description="Stylize at native resolution in overlapping tiles of this size (pixels) instead of resizing to 512")
+    overlap: int = Field(default=64, ge=0, description="Overlap in pixels between neighbouring tiles when tile_size is set, smaller than tile_size")
+    style_tokens: Optional[int] = Field(default=None, ge=1, description="Quality/speed knob: pool the style to this many tokens (e.g. 256) for faster decoding")
+
+class StyleTransferBatchItem(BaseModel):
+    """Manifest entry of one batch item"""
+    content: str
+    style: str
+    output_path: Optional[str] = None
+    error: Optional[str] = None
+
+class StyleTransferBatchResponse(BaseModel):
+    """Compact manifest of a batch request"""
+    items: List[StyleTransferBatchItem] = Field(description="One entry per pair, in request order")
+    completed: int = Field(description="Number of pairs stylized")
+    failed: int = Field(description="Number of pairs that failed")
+    seconds: float = Field(description="Wall time of the batch")
     message: str = Field(description="Status message")
+    retry_after: Optional[float] = Field(default=None, description="Seconds to wait before retrying when the server is busy")
 
-class StyleTransferModel:
-    """Singleton class to manage the style transfer model"""
+def _encoder(encoding: Optional[ImageEncoding]):
+    """encode hook of StyleTransferTool returning the image encoded with encoding, or None"""
+    return partial(encode_image, encoding=encoding) if encoding else None
+
+class StyleTransferModel(StyleTransferTool):
+    """Singleton StyleTransferTool configured from the environment that also returns encoded images"""
     _instance = None
     
     def __new__(cls):
@@ -72,149 +135,318 @@ class StyleTransferModel:
     def __init__(self):
         if self._initialized:
             return
-        
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        logger.info(f"Using device: {self.device}")
-        
-        # Model paths
-        model_dir = os.path.join(STYTR2_PATH, 'experiments')
-        self.vgg_path = os.path.join(model_dir, 'vgg_normalised.pth')
-        self.decoder_path = os.path.join(model_dir, 'decoder_iter_160000.pth')
-        self.trans_path = os.path.join(model_dir, 'transformer_iter_160000.pth')
-        self.embed_path = os.path.join(model_dir, 'embedding_iter_160000.pth')
-        
-        self._load_models()
+        super().__init__(**tool_options_from_env())
         self._initialized = True
         
-    def _load_models(self):
-        """Load all required models"""
-        # Create args namespace with required attributes
-        class Args:
-            position_embedding = 'sine'
-            hidden_dim = 512
-        args = Args()
+    def warm_up(self, sizes: List[Tuple[int, int]]):
+        """
+        Stylize a random image once per (height, width) bucket
         
-        # Load VGG
-        self.vgg = StyTR.vgg
-        self.vgg.load_state_dict(torch.load(self.vgg_path))
-        self.vgg = nn.Sequential(*list(self.vgg.children())[:44])
+        The first forward at a resolution pays for allocator growth, kernel
+        selection and, with STYLE_TRANSFER_COMPILE, graph compilation; doing it
+        here keeps that cost out of the first real request.
+        """
+        style_memory = self._encode_style_image(torch.rand(3, 512, 512)).to(self.device)
+        for height, width in sizes:
+            start = time.perf_counter()
+            content = torch.rand(1, 3, height, width, device=self.device)
+            self._stylize(trim_to_patches(content), style_memory, None, 64)
+            logger.info(f"Warmed up {height}x{width} in {time.perf_counter() - start:.2f}s")
         
-        # Load decoder
-        self.decoder = StyTR.decoder
-        new_state_dict = OrderedDict()
-        state_dict = torch.load(self.decoder_path)
-        for k, v in state_dict.items():
-            new_state_dict[k] = v
-        self.decoder.load_state_dict(new_state_dict)
+    def transfer_style_encoded(self, content_path: str, style_path: str, output_path: Optional[str],
+                       alpha: Union[float, List[float]] = 1.0,
+                       encoding: Optional[ImageEncoding] = None,
+                       tile_size: Optional[int] = None, overlap: int = 64,
+                       style_tokens: Optional[int] = None, alpha_blend: str = 'pixel'):
+        """
+        transfer_style that also returns the image encoded with encoding, if given, as (output path, image)
         
-        # Load transformer
-        self.Trans = transformer.Transformer()
-        new_state_dict = OrderedDict()
-        state_dict = torch.load(self.trans_path)
-        for k, v in state_dict.items():
-            new_state_dict[k] = v
-        self.Trans.load_state_dict(new_state_dict)
+        For a list of alphas lists of output paths (see alpha_output_path) and images are returned.
+        """
+        if isinstance(alpha, list):
+            output_paths = [alpha_output_path(output_path, a) for a in alpha]
+            images = self._transfer_style(content_path, style_path, output_paths, alpha, tile_size, overlap,
+                                          style_tokens, alpha_blend, _encoder(encoding))
+            return output_paths, images
+        images = self._transfer_style(content_path, style_path, [output_path], [alpha], tile_size, overlap,
+                                      style_tokens, alpha_blend, _encoder(encoding))
+        return output_path, images[0]
+            
+    def transfer_style_batch_encoded(self, content_paths: List[str], style_path: str, output_paths: List[Optional[str]],
+                             alpha: float = 1.0, encoding: Optional[ImageEncoding] = None, batch_size: int = 8,
+                             tile_size: Optional[int] = None, overlap: int = 64,
+                             style_tokens: Optional[int] = None, return_exceptions: bool = False):
+        """
+        transfer_style_batch that also returns the images encoded with encoding, as (output paths, images)
         
-        # Load embeddings
-        self.embedding = StyTR.PatchEmbed()
-        new_state_dict = OrderedDict()
-        state_dict = torch.load(self.embed_path)
-        for k, v in state_dict.items():
-            new_state_dict[k] = v
-        self.embedding.load_state_dict(new_state_dict)
+        With return_exceptions a failed item gets its exception in place of its image.
+        """
+        images = self._transfer_style_batch(content_paths, style_path, output_paths, alpha, batch_size,
+                                            tile_size, overlap, style_tokens, _encoder(encoding),
+                                            return_exceptions)
+        return output_paths, images
+
+def _default_output_path(content_path: str, style_path: str, output_dir: str = "output") -> str:
+    """Generate an output path in the output directory from the input names"""
+    content_name = os.path.splitext(os.path.basename(content_path))[0]
+    style_name = os.path.splitext(os.path.basename(style_path))[0]
+    # Ensure output directory exists
+    os.makedirs(output_dir, exist_ok=True)
+    return os.path.join(output_dir, f"stylized_{content_name}_with_{style_name}.jpg")
+
+def _parse_warmup_sizes(spec: str) -> List[Tuple[int, int]]:
+    """Parse "512x768,1024" into [(512, 768), (1024, 1024)]"""
+    sizes = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        height, _, width = item.partition('x')
+        sizes.append((int(height), int(width or height)))
+    return sizes
+
+def _worker_engine(warmup_sizes: List[Tuple[int, int]]) -> StyleTransferModel:
+    """Engine of one worker process, warmed up like the in-process one"""
+    model = StyleTransferModel()
+    model.warm_up(warmup_sizes)
+    return model
+
+class ModelLoader:
+    """
+    Loads StyleTransferModel and warms it up in a background thread
+    
+    The server accepts connections and lists tools while weights load; tools
+    that need the model report the loading state until it is ready.
+    """
+    
+    def __init__(self, warmup_sizes: List[Tuple[int, int]], num_workers: int = 0, threads_per_worker: Optional[int] = None,
+                 inference_threads: int = 1):
+        self.warmup_sizes = warmup_sizes
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        # In-process inference runs here, never on the event loop thread
+        self.executor = ThreadPoolExecutor(max_workers=inference_threads, thread_name_prefix="style-transfer-inference")
+        # Called with the run time in seconds of every finished call
+        self.on_finished = None
+        self.state = "idle"  # idle -> loading -> warming_up -> ready, or failed
+        self.error = None
+        # The in-process engine; with workers the engines live in the worker processes only
+        self.model = None
+        self.pool = None
+        self.runtime = None
+        self.device = None
+        self.ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._started_at = None
         
-        # Create the network
-        self.network = StyTR.StyTrans(self.vgg, self.decoder, self.embedding, self.Trans, args)
-        self.network.eval()
-        self.network.to(self.device)
+    def start(self):
+        """Start loading once; later calls are no-ops"""
+        with self._lock:
+            if self._thread is None:
+                self._started_at = time.perf_counter()
+                self._thread = threading.Thread(target=self._load, name="style-transfer-loader", daemon=True)
+                self._thread.start()
         
-    def transfer_style(self, content_path: str, style_path: str, output_path: str, alpha: float = 1.0, return_base64: bool = False):
-        """Perform style transfer"""
+    def _load(self):
         try:
-            # Load and preprocess images
-            content_tf = test_transform(size=512, crop=False)
-            style_tf = test_transform(size=512, crop=False)
-            
-            content = content_tf(Image.open(content_path).convert('RGB'))
-            style = style_tf(Image.open(style_path).convert('RGB'))
-            
-            style = style.to(self.device).unsqueeze(0)
-            content = content.to(self.device).unsqueeze(0)
-            
-            with torch.no_grad():
-                # Use the network directly
-                output = self.network(content, style)
-            
-            # Save output
-            output = output.cpu()
-            
-            # Apply alpha blending if needed
-            if alpha < 1.0:
-                output = output * alpha + content.cpu() * (1.0 - alpha)
-            
-            base64_str = None
-            if return_base64:
-                # Save to buffer first using save_image to ensure proper formatting
-                from io import BytesIO
-                import tempfile
-                with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-                    save_image(output, tmp.name)
-                    tmp_path = tmp.name
-                
-                # Read back and convert to base64
-                with open(tmp_path, 'rb') as f:
-                    base64_str = base64.b64encode(f.read()).decode()
-                os.unlink(tmp_path)
-            
-            if output_path:
-                # Ensure output directory exists before saving
-                output_dir = os.path.dirname(output_path)
-                if output_dir:
-                    os.makedirs(output_dir, exist_ok=True)
-                save_image(output, output_path)
-            
-            return output_path, base64_str
-            
+            self.state = "loading"
+            options = tool_options_from_env()
+            self.runtime = options['runtime']
+            if self.num_workers > 1 and self.runtime == 'torch' and not torch.cuda.is_available():
+                self.device = 'cpu'
+                # Loaded once here, so the packed checkpoint and quantized modules exist before the workers
+                # start, then released: every request is served by the engine of a worker
+                StyleTransferTool(**options)
+                self.state = "warming_up"
+                # Each spawned worker loads and warms up its own engine
+                self.pool = WorkerPool(partial(_worker_engine, self.warmup_sizes), self.num_workers,
+                                       self.threads_per_worker)
+            else:
+                if self.num_workers > 1:
+                    logger.warning("STYLE_TRANSFER_WORKERS needs the torch runtime on CPU, serving in-process")
+                model = StyleTransferModel()
+                self.device = str(model.device)
+                self.state = "warming_up"
+                model.warm_up(self.warmup_sizes)
+                self.model = model
+            self.state = "ready"
+            logger.info(f"Model ready after {time.perf_counter() - self._started_at:.1f}s")
         except Exception as e:
-            logger.error(f"Style transfer failed: {str(e)}")
-            raise
+            self.error = str(e)
+            self.state = "failed"
+            logger.error(f"Model loading failed: {self.error}")
+        finally:
+            self.ready.set()
+        
+    async def wait(self, timeout: float) -> bool:
+        """Whether the model is ready, waiting up to timeout seconds without blocking the event loop"""
+        self.start()
+        if not self.ready.is_set() and timeout > 0:
+            await asyncio.to_thread(self.ready.wait, timeout)
+        return self.state == "ready"
+        
+    def status(self) -> dict:
+        """Readiness report for clients"""
+        elapsed = time.perf_counter() - self._started_at if self._started_at is not None else 0.0
+        return {
+            "state": self.state,
+            "ready": self.state == "ready",
+            "seconds_since_start": round(elapsed, 1),
+            "warmup_sizes": [f"{h}x{w}" for h, w in self.warmup_sizes],
+            "workers": self.pool.num_workers if self.pool else 0,
+            "error": self.error,
+        }
+        
+    async def run(self, method: str, *args, **kwargs):
+        """Call a StyleTransferModel method on an idle worker process, or in-process without workers"""
+        if self.pool is not None:
+            start = time.perf_counter()
+            result = await asyncio.wrap_future(self.pool.submit(method, *args, **kwargs))
+            self._finished(time.perf_counter() - start)
+            return result
+        
+        def call():
+            start = time.perf_counter()
+            result = getattr(self.model, method)(*args, **kwargs)
+            self._finished(time.perf_counter() - start)
+            return result
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+        
+    def _finished(self, seconds: float):
+        if self.on_finished is not None:
+            self.on_finished(seconds)
+        
+    def not_ready_message(self) -> str:
+        if self.state == "failed":
+            return f"Style transfer model failed to load: {self.error}"
+        return f"Style transfer model is not ready yet (state: {self.state}), please retry in a few seconds"
+
+# Model loading starts with the server and runs in the background;
+# STYLE_TRANSFER_WARMUP lists the resolution buckets to warm up ("" disables warm-up)
+# STYLE_TRANSFER_WORKERS > 1 serves requests from that many spawned worker processes sharing the weights;
+# otherwise STYLE_TRANSFER_INFERENCE_THREADS threads run inference in-process
+WORKERS = int(os.environ.get('STYLE_TRANSFER_WORKERS', 0))
+INFERENCE_THREADS = int(os.environ.get('STYLE_TRANSFER_INFERENCE_THREADS', 1))
+loader = ModelLoader(_parse_warmup_sizes(os.environ.get('STYLE_TRANSFER_WARMUP', '512x512')),
+                     WORKERS,
+                     int(os.environ['STYLE_TRANSFER_THREADS_PER_WORKER']) if os.environ.get('STYLE_TRANSFER_THREADS_PER_WORKER') else None,
+                     INFERENCE_THREADS)
+
+# Requests beyond the running ones plus STYLE_TRANSFER_MAX_QUEUED waiting ones get an immediate "busy" answer
+admission = AdmissionQueue(WORKERS if WORKERS > 1 else INFERENCE_THREADS,
+                           int(os.environ.get('STYLE_TRANSFER_MAX_QUEUED', 16)))
+loader.on_finished = admission.observe
+
+# Seconds a tool call waits for a model that is still loading before reporting the loading state
+READY_TIMEOUT = float(os.environ.get('STYLE_TRANSFER_READY_TIMEOUT', 60))
+
+# Seconds get_model_status waits for busy workers to report their cache statistics
+STATS_TIMEOUT = float(os.environ.get('STYLE_TRANSFER_STATS_TIMEOUT', 2))
+
+async def _run_micro_batch(key: tuple, items: List[Tuple[str, Optional[str]]]) -> list:
+    """
+    Stylize (content_path, output_path) items that share a style and options in batched forwards
+    
+    Returns (output_path, image) per item, or the exception of an item that failed.
+    """
+    style_path, alpha, encoding, tile_size, overlap, style_tokens = key
+    output_paths, images = await loader.run(
+        'transfer_style_batch_encoded',
+        [content_path for content_path, _ in items],
+        style_path,
+        [output_path for _, output_path in items],
+        alpha,
+        encoding,
+        batch_size=MAX_BATCH,
+        tile_size=tile_size,
+        overlap=overlap,
+        style_tokens=style_tokens,
+        return_exceptions=True
+    )
+    return [image if isinstance(image, Exception) else (output_path, image)
+            for output_path, image in zip(output_paths, images)]
+
+# Concurrent single-image requests with the same style and options arriving within
+# STYLE_TRANSFER_BATCH_WINDOW_MS are run as one batched forward (0 disables micro-batching)
+MAX_BATCH = int(os.environ.get('STYLE_TRANSFER_MAX_BATCH', 8))
+BATCH_WINDOW = float(os.environ.get('STYLE_TRANSFER_BATCH_WINDOW_MS', 0)) / 1000
+batcher = MicroBatcher(_run_micro_batch, BATCH_WINDOW, MAX_BATCH) if BATCH_WINDOW > 0 else None
 
-# Initialize model
-model = StyleTransferModel()
+# Identical single-image requests arriving while one of them runs share its result; only the running one
+# takes an admission slot, so a crowd asking for the same image is not turned away as busy
+flights = SingleFlight()
 
 @mcp.tool()
-async def apply_style_transfer(request: StyleTransferRequest) -> StyleTransferResponse:
+async def apply_style_transfer(request: StyleTransferRequest) -> Union[StyleTransferResponse, list]:
     """
     Apply artistic style transfer to an image using StyTR-2.
     
     This tool takes a content image and applies the artistic style from a style image.
     The result preserves the content but renders it in the specified artistic style.
+    With return_image the stylized images are also returned as image content.
     """
+    if not await loader.wait(READY_TIMEOUT):
+        return StyleTransferResponse(
+            output_path=None,
+            base64_image=None,
+            message=loader.not_ready_message()
+        )
+    
     try:
+        return await _apply_style_transfer(request)
+    except ServerBusy as e:
+        return StyleTransferResponse(
+            output_path=None,
+            base64_image=None,
+            message=f"Style transfer server is busy, retry after {e.retry_after:.1f}s",
+            retry_after=e.retry_after
+        )
+
+def _with_images(response: StyleTransferResponse, request: StyleTransferRequest,
+                 images: List[Optional[bytes]]) -> Union[StyleTransferResponse, list]:
+    """Fill the base64 fields and/or attach MCP image content, as the request asked"""
+    if request.return_base64:
+        encoded = [base64.b64encode(image).decode() if image else None for image in images]
+        if response.output_paths is None:
+            response.base64_image = encoded[0]
+        else:
+            response.base64_images = encoded
+    if not request.return_image:
+        return response
+    return [response] + [MCPImage(data=image, format=request.image_format) for image in images if image]
+
+async def _apply_style_transfer(request: StyleTransferRequest) -> Union[StyleTransferResponse, list]:
+    """Run a request; raises ServerBusy when it is not admitted"""
+    try:
+        if isinstance(request.content_image_path, list):
+            async with admission.slot():
+                return await _apply_style_transfer_batch(request)
+        
         # Generate output path if not provided
-        if request.output_path is None and not request.return_base64:
-            content_name = os.path.splitext(os.path.basename(request.content_image_path))[0]
-            style_name = os.path.splitext(os.path.basename(request.style_image_path))[0]
-            # Ensure output directory exists
-            output_dir = "output"
-            os.makedirs(output_dir, exist_ok=True)
-            request.output_path = os.path.join(output_dir, f"stylized_{content_name}_with_{style_name}.jpg")
+        if request.output_path is None and not (request.return_base64 or request.return_image):
+            request.output_path = _default_output_path(request.content_image_path, request.style_image_path)
         
-        # Perform style transfer
-        output_path, base64_image = model.transfer_style(
-            request.content_image_path,
-            request.style_image_path,
-            request.output_path,
-            request.alpha,
-            request.return_base64
-        )
+        # Perform style transfer, or wait for the identical one already running
+        sweep = isinstance(request.alpha, list)
+        flight_key = (request.content_image_path, request.style_image_path, request.output_path,
+                      tuple(request.alpha) if sweep else request.alpha, request.alpha_blend,
+                      request.encoding(), request.tile_size, request.overlap, request.style_tokens)
+        output_path, image = await flights.do(flight_key, lambda: _stylize(request))
         
-        return StyleTransferResponse(
+        if sweep:
+            return _with_images(StyleTransferResponse(
+                output_path=None,
+                base64_image=None,
+                output_paths=output_path,
+                message=f"Style transfer with {len(request.alpha)} alphas completed successfully!"
+            ), request, image)
+        
+        return _with_images(StyleTransferResponse(
             output_path=output_path,
-            base64_image=base64_image,
+            base64_image=None,
             message=f"Style transfer completed successfully!"
-        )
+        ), request, [image])
         
+    except ServerBusy:
+        raise
     except Exception as e:
         return StyleTransferResponse(
             output_path=None,
@@ -222,6 +454,183 @@ async def apply_style_transfer(request: StyleTransferRequest) -> StyleTransferRe
             message=f"Style transfer failed: {str(e)}"
         )
 
+async def _stylize(request: StyleTransferRequest):
+    """
+    Stylize one content image in an admission slot, micro-batched with its neighbours when enabled
+    
+    Returns (output path, image), or lists of both for a list of alphas.
+    """
+    async with admission.slot():
+        if batcher is not None and not isinstance(request.alpha, list) and request.alpha_blend == 'pixel':
+            batch_key = (request.style_image_path, request.alpha, request.encoding(),
+                         request.tile_size, request.overlap, request.style_tokens)
+            return await batcher.submit(batch_key, (request.content_image_path, request.output_path))
+        return await loader.run(
+            'transfer_style_encoded',
+            request.content_image_path,
+            request.style_image_path,
+            request.output_path,
+            request.alpha,
+            request.encoding(),
+            tile_size=request.tile_size,
+            overlap=request.overlap,
+            style_tokens=request.style_tokens,
+            alpha_blend=request.alpha_blend
+        )
+
+async def _apply_style_transfer_batch(request: StyleTransferRequest) -> Union[StyleTransferResponse, list]:
+    """Stylize a list of content images with one style in batched forwards"""
+    content_paths = request.content_image_path
+    output_paths = request.output_path
+    if output_paths is None:
+        output_paths = [None if request.return_base64 or request.return_image
+                        else _default_output_path(path, request.style_image_path)
+                        for path in content_paths]
+    elif not isinstance(output_paths, list) or len(output_paths) != len(content_paths):
+        raise ValueError("output_path must be a list with one path per content image")
+    if isinstance(request.alpha, list) or request.alpha_blend != 'pixel':
+        raise ValueError("alpha lists and alpha_blend='feature' take a single content image")
+    
+    output_paths, images = await loader.run(
+        'transfer_style_batch_encoded',
+        content_paths,
+        request.style_image_path,
+        output_paths,
+        request.alpha,
+        request.encoding(),
+        tile_size=request.tile_size,
+        overlap=request.overlap,
+        style_tokens=request.style_tokens
+    )
+    
+    return _with_images(StyleTransferResponse(
+        output_path=None,
+        base64_image=None,
+        output_paths=output_paths,
+        message=f"Style transfer of {len(content_paths)} images completed successfully!"
+    ), request, images)
+
+@mcp.tool()
+async def apply_style_transfer_batch(request: StyleTransferBatchRequest, ctx: Context) -> StyleTransferBatchResponse:
+    """
+    Apply style transfer to many content/style pairs in one call.
+    
+    Pass explicit pairs, or content_image_paths and style_image_paths to stylize
+    every content image with every style. Each style is encoded once and its
+    content images are stylized in batched forwards. Progress is reported as
+    items finish; the result is a manifest of output paths.
+    """
+    pairs = list(request.pairs or [])
+    if request.content_image_paths or request.style_image_paths:
+        pairs += [StylePair(content_image_path=content, style_image_path=style)
+                  for content in request.content_image_paths or [] for style in request.style_image_paths or []]
+    items = [StyleTransferBatchItem(content=pair.content_image_path, style=pair.style_image_path,
+                                    output_path=pair.output_path or _default_output_path(
+                                        pair.content_image_path, pair.style_image_path, request.output_dir))
+             for pair in pairs]
+    if not items:
+        return StyleTransferBatchResponse(items=[], completed=0, failed=0, seconds=0.0,
+                                          message="No content/style pairs given")
+    
+    if not await loader.wait(READY_TIMEOUT):
+        return StyleTransferBatchResponse(items=items, completed=0, failed=0, seconds=0.0,
+                                          message=loader.not_ready_message())
+    
+    start = time.perf_counter()
+    try:
+        async with admission.slot():
+            await _run_batch_items(request, items, ctx)
+    except ServerBusy as e:
+        return StyleTransferBatchResponse(items=items, completed=0, failed=0, seconds=0.0,
+                                          message=f"Style transfer server is busy, retry after {e.retry_after:.1f}s",
+                                          retry_after=e.retry_after)
+    
+    failed = sum(item.error is not None for item in items)
+    return StyleTransferBatchResponse(
+        items=items,
+        completed=len(items) - failed,
+        failed=failed,
+        seconds=round(time.perf_counter() - start, 2),
+        message=f"Style transfer of {len(items) - failed}/{len(items)} pairs completed"
+    )
+
+async def _run_batch_items(request: StyleTransferBatchRequest, items: List[StyleTransferBatchItem], ctx: Context):
+    """Stylize items grouped by style, one batched call per MAX_BATCH contents, reporting progress per call"""
+    groups = {}
+    for item in items:
+        groups.setdefault(item.style, []).append(item)
+    
+    done = 0
+    await ctx.report_progress(0, len(items))
+    for style_path, group in groups.items():
+        for start in range(0, len(group), MAX_BATCH):
+            chunk = group[start:start + MAX_BATCH]
+            try:
+                _, images = await loader.run(
+                    'transfer_style_batch_encoded',
+                    [item.content for item in chunk],
+                    style_path,
+                    [item.output_path for item in chunk],
+                    request.alpha,
+                    None,
+                    batch_size=MAX_BATCH,
+                    tile_size=request.tile_size,
+                    overlap=request.overlap,
+                    style_tokens=request.style_tokens,
+                    return_exceptions=True
+                )
+                errors = [image if isinstance(image, Exception) else None for image in images]
+            except Exception as e:
+                errors = [e] * len(chunk)
+            for item, error in zip(chunk, errors):
+                if error is not None:
+                    item.output_path, item.error = None, str(error)
+            done += len(chunk)
+            # Items of one call come out of the same forward, so they finish together
+            await ctx.report_progress(done, len(items))
+            await ctx.info(f"Stylized {done}/{len(items)}: {', '.join(os.path.basename(item.content) for item in chunk)} "
+                           f"with {os.path.basename(style_path)}")
+
+@mcp.tool()
+async def get_model_status() -> dict:
+    """Report whether the style transfer model is loading, warming up, ready or failed"""
+    loader.start()
+    status = loader.status()
+    status["admission"] = admission.stats()
+    if batcher is not None:
+        status["micro_batching"] = batcher.stats()
+    if loader.pool is not None:
+        status["worker_pool"] = loader.pool.stats()
+    status["single_flight"] = flights.stats()
+    if loader.pool is not None:
+        status.update(await _worker_cache_stats(loader.pool))
+    elif loader.model is not None:
+        status.update(loader.model.stats())
+    return status
+
+async def _worker_cache_stats(pool: WorkerPool) -> dict:
+    """
+    Cache statistics summed over the workers that answer within STATS_TIMEOUT seconds
+    
+    A worker answers after the request it is running. Hit counts and image cache
+    sizes add up; the result cache directory is shared, so its size is reported once.
+    """
+    futures = [asyncio.wrap_future(future) for future in pool.submit_all('stats')]
+    if not futures:
+        return {}
+    done, _ = await asyncio.wait(futures, timeout=STATS_TIMEOUT)
+    reports = [future.result() for future in done if future.exception() is None]
+    merged = {"workers_reporting": len(reports)}
+    for report in reports:
+        for name, stats in report.items():
+            total = merged.setdefault(name, dict.fromkeys(stats, 0))
+            for field, value in stats.items():
+                if name == "result_cache" and field not in ("hits", "misses"):
+                    total[field] = value
+                else:
+                    total[field] += value
+    return merged
+
 @mcp.tool()
 async def list_available_styles() -> dict:
     """List available style images in the demo directory"""
@@ -260,14 +669,19 @@ async def list_content_images() -> dict:
 @mcp.resource("style-transfer://model-info")
 async def get_model_info() -> str:
     """Get information about the style transfer model"""
+    loader.start()
+    runtime = loader.runtime or os.environ.get('STYLE_TRANSFER_RUNTIME', 'torch')
+    device = loader.device or "(loading)"
     return f"""
 # StyTR-2 Style Transfer Model
 
 ## Model Information
 - Framework: PyTorch
-- Device: {model.device}
+- Status: {loader.state}
+- Runtime: {runtime}
+- Device: {device}
 - Model Components:
-  - VGG Feature Extractor
+  - VGG Feature Extractor (training losses only, not loaded for inference)
   - Transformer Module
   - Patch Embedding
   - Decoder
@@ -284,11 +698,21 @@ Use the `apply_style_transfer` tool with:
 - alpha: Style strength (0.0-1.0)
 - output_path: Where to save the result (optional)
 - return_base64: Return result as base64 string (optional)
+- return_image: Return result as MCP image content (optional); image_format (jpeg/png/webp),
+  image_quality and preview_size control its encoding and size
+- tile_size / overlap: Stylize large images at native resolution in overlapping tiles (optional)
+- style_tokens: Pool the style to this many tokens for faster decoding (optional)
+
+Use `apply_style_transfer_batch` for many pairs at once (explicit `pairs`, or
+`content_image_paths` crossed with `style_image_paths`); it reports progress as
+items finish and returns a manifest of output paths.
 
 ## Demo Images
 Use `list_available_styles` and `list_content_images` to see available demo images.
 """
 
 if __name__ == "__main__":
+    # Load weights in the background so the MCP handshake does not wait for them
+    loader.start()
     # Run the server
     mcp.run() 
\ No newline at end of file
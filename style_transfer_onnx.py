@@ -0,0 +1,134 @@
+"""
+ONNX export of the inference-only StyTR-2 graph
+Writes two graphs with dynamic batch, spatial and style-token axes:
+the style encoder (PatchEmbed + encoder_s) and the stylization graph
+(PatchEmbed + encoder_c + decoder + CNN decoder over a style memory).
+style_transfer_ort.py runs them on ONNX Runtime.
+
+Run this module directly to export the graphs for the default checkpoints:
+
+    python style_transfer_onnx.py
+"""
+
+import os
+import copy
+import logging
+import tempfile
+import warnings
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+
+from style_transfer_compile import StylizeGraph
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ONNX_OPSET = 17
+
+
+class AdaptiveAvgPool2dExport(nn.Module):
+    """
+    nn.AdaptiveAvgPool2d written as two pooling matrices built from the input shape
+
+    ONNX has no adaptive pooling for dynamic input sizes; this computes the
+    same bins (floor(i*H/n) to ceil((i+1)*H/n)) with ops that export with
+    dynamic axes.
+    """
+
+    def __init__(self, output_size: int):
+        super().__init__()
+        self.output_size = output_size
+
+    def _pooling_matrix(self, size, like: torch.Tensor) -> torch.Tensor:
+        n = self.output_size
+        bins = torch.arange(n, device=like.device)
+        start = torch.div(bins * size, n, rounding_mode='floor')
+        end = torch.div((bins + 1) * size + n - 1, n, rounding_mode='floor')
+        positions = torch.arange(size, device=like.device)
+        weights = ((positions[None] >= start[:, None]) & (positions[None] < end[:, None])).to(like.dtype)
+        return weights / weights.sum(1, keepdim=True)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self._pooling_matrix(x.shape[-2], x) @ x @ self._pooling_matrix(x.shape[-1], x).t()
+
+
+class StyleEncoderGraph(nn.Module):
+    """Style image to style memory, as StyTrans.encode_style"""
+
+    def __init__(self, network: nn.Module):
+        super().__init__()
+        self.embedding = network.embedding
+        self.transformer = network.transformer
+
+    def forward(self, style: torch.Tensor) -> torch.Tensor:
+        return self.transformer.encode_style(self.embedding(style))
+
+
+def onnx_paths(onnx_dir: str, checkpoint: str) -> Tuple[str, str]:
+    """Paths of the style encoder and stylization graphs exported for a checkpoint fingerprint"""
+    return (os.path.join(onnx_dir, f"stytr2_style_{checkpoint}.onnx"),
+            os.path.join(onnx_dir, f"stytr2_stylize_{checkpoint}.onnx"))
+
+
+def _export(module: nn.Module, args: tuple, path: str, input_names, dynamic_axes):
+    """Export to a temporary file and move it into place, so readers never see a partial graph"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        with warnings.catch_warnings(), torch.no_grad():
+            warnings.simplefilter('ignore')
+            torch.onnx.export(module, args, tmp_path, input_names=input_names, output_names=['output'],
+                              dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, dynamo=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def export_onnx(network: nn.Module, onnx_dir: str, checkpoint: str) -> Tuple[str, str]:
+    """
+    Export a float StyTrans network, unless graphs for the checkpoint already exist
+
+    Args:
+        network: Float StyTrans network (not quantized), in eval mode
+        onnx_dir: Directory for the .onnx files
+        checkpoint: Fingerprint of the checkpoints the network was loaded from
+
+    Returns:
+        Paths of the style encoder and stylization graphs
+    """
+    style_path, stylize_path = onnx_paths(onnx_dir, checkpoint)
+    if os.path.exists(style_path) and os.path.exists(stylize_path):
+        return style_path, stylize_path
+    os.makedirs(onnx_dir, exist_ok=True)
+
+    # Exportable copy: matrix pooling and sdpa attention keep every axis dynamic
+    network = copy.deepcopy(network).cpu().eval()
+    network.transformer.averagepooling = AdaptiveAvgPool2dExport(network.transformer.averagepooling.output_size)
+    network.transformer.set_attention_backend('sdpa')
+    d_model = network.transformer.d_model
+
+    logger.info(f"Exporting StyTR-2 to ONNX in {onnx_dir}")
+    image_axes = {0: 'batch', 2: 'height', 3: 'width'}
+    _export(StyleEncoderGraph(network), (torch.rand(1, 3, 256, 256),), style_path, ['style'],
+            {'style': {2: 'height', 3: 'width'}, 'output': {0: 'tokens'}})
+    _export(StylizeGraph(network), (torch.rand(1, 3, 256, 256), torch.rand(1024, 1, d_model)), stylize_path,
+            ['content', 'style_memory'],
+            {'content': image_axes, 'style_memory': {0: 'tokens'}, 'output': image_axes})
+    return style_path, stylize_path
+
+
+if __name__ == "__main__":
+    import argparse
+    from style_transfer_tool import StyleTransferTool
+
+    parser = argparse.ArgumentParser(description="Export StyTR-2 to ONNX for style_transfer_ort.py")
+    parser.add_argument('--model-dir', default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    tool = StyleTransferTool(model_dir=args.model_dir, runtime='onnx')
+    print('\n'.join(tool.onnx_paths))
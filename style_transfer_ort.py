@@ -0,0 +1,118 @@
+"""
+ONNX Runtime backend for StyTR-2
+Runs the graphs written by style_transfer_onnx.py with numpy, PIL and
+onnxruntime only, so CPU workers can stylize without importing torch:
+
+    python style_transfer_ort.py content.jpg style.jpg output.jpg --onnx-dir StyTR-2/experiments/onnx
+"""
+
+import os
+import glob
+import logging
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+PATCH_SIZE = 8
+
+
+def load_image(path: str, size: int = 512) -> np.ndarray:
+    """
+    Same preprocessing as test_transform(size) without torchvision
+
+    Resizes the short side to size (0 keeps the native resolution), scales
+    to [0, 1] and trims to multiples of the patch size. Returns 3xHxW float32.
+    """
+    img = Image.open(path).convert('RGB')
+    if size != 0:
+        w, h = img.size
+        short, long = (w, h) if w <= h else (h, w)
+        new_short, new_long = size, int(size * long / short)
+        new_w, new_h = (new_short, new_long) if w <= h else (new_long, new_short)
+        img = img.resize((new_w, new_h), Image.BILINEAR)
+    array = np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0
+    h, w = array.shape[-2:]
+    return np.ascontiguousarray(array[:, :h - h % PATCH_SIZE, :w - w % PATCH_SIZE])
+
+
+def save_image(output: np.ndarray, output_path: str):
+    """Write a 3xHxW image in [0, 1], rounded like torchvision.utils.save_image"""
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    pixels = np.clip(output * 255 + 0.5, 0, 255).astype(np.uint8).transpose(1, 2, 0)
+    Image.fromarray(pixels).save(output_path)
+
+
+class OnnxStylizer:
+    """
+    ONNX Runtime sessions for the style encoder and the stylization graph
+
+    Args:
+        style_path: ONNX file of PatchEmbed + encoder_s (style image -> style memory)
+        stylize_path: ONNX file of PatchEmbed + encoder_c + decoder + CNN decoder
+        num_threads: Intra-op threads per session; 0 lets ONNX Runtime decide
+    """
+
+    def __init__(self, style_path: str, stylize_path: str, num_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        providers = ['CPUExecutionProvider']
+        self.style_session = ort.InferenceSession(style_path, options, providers=providers)
+        self.stylize_session = ort.InferenceSession(stylize_path, options, providers=providers)
+
+    @classmethod
+    def from_dir(cls, onnx_dir: str, checkpoint: Optional[str] = None, num_threads: int = 0) -> 'OnnxStylizer':
+        """Open the graphs exported for a checkpoint fingerprint, or the newest export in onnx_dir"""
+        if checkpoint is None:
+            exports = sorted(glob.glob(os.path.join(onnx_dir, 'stytr2_stylize_*.onnx')), key=os.path.getmtime)
+            if not exports:
+                raise FileNotFoundError(f"No exported StyTR-2 graphs in {onnx_dir}, run style_transfer_onnx.py first")
+            checkpoint = os.path.basename(exports[-1])[len('stytr2_stylize_'):-len('.onnx')]
+        return cls(os.path.join(onnx_dir, f"stytr2_style_{checkpoint}.onnx"),
+                   os.path.join(onnx_dir, f"stytr2_stylize_{checkpoint}.onnx"), num_threads)
+
+    def encode_style(self, style: np.ndarray) -> np.ndarray:
+        """1x3xHxW style image to its HWx1xC style memory"""
+        return self.style_session.run(None, {'style': np.ascontiguousarray(style, dtype=np.float32)})[0]
+
+    def stylize(self, content: np.ndarray, style_memory: np.ndarray) -> np.ndarray:
+        """Bx3xHxW content batch and one Sx1xC style memory to Bx3xHxW stylized images"""
+        return self.stylize_session.run(None, {
+            'content': np.ascontiguousarray(content, dtype=np.float32),
+            'style_memory': np.ascontiguousarray(style_memory, dtype=np.float32),
+        })[0]
+
+    def transfer_style(self, content_path: str, style_path: str, output_path: str, alpha: float = 1.0) -> str:
+        """Stylize one content image at 512 and save it, as StyleTransferTool.transfer_style does"""
+        content = load_image(content_path, 512)[None]
+        style_memory = self.encode_style(load_image(style_path, 512)[None])
+        output = self.stylize(content, style_memory)[0]
+        if alpha < 1.0:
+            output = output * alpha + content[0] * (1.0 - alpha)
+        save_image(output, output_path)
+        return output_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stylize an image with the exported StyTR-2 graphs on ONNX Runtime")
+    parser.add_argument('content')
+    parser.add_argument('style')
+    parser.add_argument('output')
+    parser.add_argument('--alpha', type=float, default=1.0)
+    parser.add_argument('--onnx-dir', default=os.path.join(os.path.dirname(__file__), 'StyTR-2', 'experiments', 'onnx'))
+    parser.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    stylizer = OnnxStylizer.from_dir(args.onnx_dir, num_threads=args.threads)
+    print(stylizer.transfer_style(args.content, args.style, args.output, args.alpha))
@@ -0,0 +1,77 @@
+"""
+Reduced-precision inference for StyTR-2
+Runs embedding, transformer and decoder under bfloat16 autocast, guarded by
+a PSNR check against fp32 on a reference image
+"""
+
+import logging
+import contextlib
+
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from style_transfer_quantization import demo_calibration_pairs, psnr
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ('fp32', 'bf16')
+
+
+def bf16_supported(device: torch.device) -> bool:
+    """Whether the device has native bfloat16 matmul support"""
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def autocast(device: torch.device, precision: str):
+    """
+    Context manager for the requested precision.
+
+    bfloat16 autocast lowers convolutions and matmuls, while layer norms,
+    softmax and reductions stay in fp32 per PyTorch's autocast op lists.
+    """
+    if precision == 'bf16':
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def guard_precision(network: nn.Module, device: torch.device, precision: str, transform,
+                    min_psnr: float = 30.0) -> str:
+    """
+    Validate a precision choice and return the precision to actually use
+
+    bf16 is refused (falling back to fp32) when the device lacks bfloat16
+    support or when a stylized reference image deviates from fp32 by less
+    than min_psnr dB.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision should be one of {PRECISIONS}, not {precision}")
+    if precision == 'fp32':
+        return precision
+    if not bf16_supported(device):
+        logger.warning(f"bfloat16 is not supported on this {device.type}, using fp32")
+        return 'fp32'
+
+    pairs = demo_calibration_pairs()
+    if not pairs:
+        logger.warning("No reference image for the bf16 accuracy check, using fp32")
+        return 'fp32'
+    content_path, style_path = pairs[0]
+    content = transform(Image.open(content_path).convert('RGB')).unsqueeze(0).to(device)
+    style = transform(Image.open(style_path).convert('RGB')).unsqueeze(0).to(device)
+
+    expected = network.inference(content, style)
+    with autocast(device, precision):
+        output = network.inference(content, style)
+    score = psnr(output.float(), expected)
+    if score < min_psnr:
+        logger.warning(f"bf16 output is {score:.1f} dB PSNR from fp32 (threshold {min_psnr} dB), using fp32")
+        return 'fp32'
+    logger.info(f"bf16 enabled, {score:.1f} dB PSNR from fp32 on the reference image")
+    return precision
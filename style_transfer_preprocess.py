@@ -0,0 +1,127 @@
+"""
+Fast image preprocessing for StyTR-2
+Replaces Image.open(path).convert('RGB') followed by transforms.Resize(size):
+
+- the image size is read from the header and oversized images
+  (decompression bombs) are rejected before any pixel is decoded
+- JPEGs are decoded at 1/2, 1/4 or 1/8 scale (draft mode) and other formats
+  are box-reduced by an integer factor, landing just above the target size
+- the final antialiased resize runs on the uint8 tensor
+
+Preprocessed images are kept in an LRU keyed by path, mtime and file size,
+so repeated contents and styles are not decoded again.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.transforms import InterpolationMode
+from torchvision.transforms import functional as F
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+# Modes Image.reduce handles; palette, bilevel and 16-bit images are converted to RGB before reducing
+_REDUCE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'I', 'F')
+
+
+def _target_size(width: int, height: int, size: int):
+    """(width, height) after resizing the short side to size, as transforms.Resize(size) does"""
+    if width <= height:
+        return size, int(size * height / width)
+    return int(size * width / height), size
+
+
+def load_image(path: str, size: int = 512, max_pixels: int = Image.MAX_IMAGE_PIXELS) -> torch.Tensor:
+    """
+    Decode an image as a 3xHxW uint8 tensor with the short side resized to size
+
+    Args:
+        path: Image file
+        size: Target length of the short side; 0 keeps the native resolution
+        max_pixels: Larger images are rejected with ValueError before decoding
+    """
+    with Image.open(path) as img:
+        width, height = img.size
+        if max_pixels and width * height > max_pixels:
+            raise ValueError(f"{path} is {width}x{height} pixels, more than the allowed {max_pixels}")
+
+        if size != 0:
+            target = _target_size(width, height, size)
+            # JPEG only: the decoder scales by 1/2, 1/4 or 1/8 while keeping at least target
+            img.draft('RGB', target)
+            if img.mode not in _REDUCE_MODES:
+                img = img.convert('RGB')
+            factor = min(img.size) // size
+            if factor >= 2:
+                img = img.reduce(factor)
+
+        array = np.array(img.convert('RGB'))
+
+    image = torch.from_numpy(array).permute(2, 0, 1)
+    if size != 0 and min(image.shape[-2:]) != size:
+        image = F.resize(image, size, interpolation=InterpolationMode.BILINEAR, antialias=True)
+    return image.contiguous()
+
+
+class ImageLoader:
+    """
+    load_image with an LRU of the resized uint8 tensors
+
+    Args:
+        cache_bytes: Memory budget of the LRU; 0 disables caching
+        max_pixels: Larger images are rejected before decoding
+    """
+
+    def __init__(self, cache_bytes: int = 256 * 1024 * 1024, max_pixels: int = Image.MAX_IMAGE_PIXELS):
+        self.cache_bytes = cache_bytes
+        self.max_pixels = max_pixels
+        self._cache: "OrderedDict[tuple, torch.Tensor]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path: str, size: int = 512) -> torch.Tensor:
+        """3xHxW float image in [0, 1] with the short side resized to size, like Resize(size) + ToTensor()"""
+        return self.load_uint8(path, size).float().div_(255)
+
+    def load_uint8(self, path: str, size: int = 512) -> torch.Tensor:
+        """The cached uint8 tensor for path at size; do not modify it in place"""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, size)
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        image = load_image(path, size, self.max_pixels)
+        nbytes = image.numel()
+        if nbytes <= self.cache_bytes:
+            with self._lock:
+                if key not in self._cache:
+                    self._cache[key] = image
+                    self._bytes += nbytes
+                while self._bytes > self.cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._bytes -= evicted.numel()
+        return image
+
+    def stats(self) -> dict:
+        """Hit/miss counts and memory held by the LRU"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._cache),
+            "bytes": self._bytes,
+            "max_bytes": self.cache_bytes,
+        }
@@ -0,0 +1,241 @@
+"""
+Quantized CPU inference for StyTR-2
+Dynamic int8 for the transformer linears and attention projections and,
+optionally, static int8 for the CNN decoder convolutions calibrated on the
+demo images. The quantized modules are cached on disk and loaded as they
+are, so worker processes neither quantize nor recalibrate at startup.
+
+Run this module directly to build the cache and report speed and quality
+against the float model:
+
+    python style_transfer_quantization.py --mode static
+"""
+
+import os
+import copy
+import time
+import logging
+import tempfile
+import warnings
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import torch
+import torch.nn as nn
+from PIL import Image
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+STYTR2_PATH = os.path.join(os.path.dirname(__file__), 'StyTR-2')
+
+# "dynamic": int8 transformer linears; "static": additionally int8 decoder convs
+QUANTIZATION_MODES = ('dynamic', 'static')
+
+
+def _select_engine() -> str:
+    """Pick the best available quantized CPU kernel backend"""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("No quantized CPU engine is available in this PyTorch build")
+
+
+def demo_calibration_pairs() -> List[Tuple[str, str]]:
+    """Every demo content image crossed with every demo style image"""
+    def images(folder):
+        folder = os.path.join(STYTR2_PATH, 'demo', folder)
+        if not os.path.isdir(folder):
+            return []
+        return [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                if f.endswith(('.png', '.jpg', '.jpeg'))]
+    return [(c, s) for c in images('c_img') for s in images('s_img')]
+
+
+def load_pairs(pairs: Sequence[Tuple[str, str]], transform: Callable) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """Preprocess (content, style) image paths into 1xCxHxW tensors"""
+    return [(transform(Image.open(c).convert('RGB')).unsqueeze(0),
+             transform(Image.open(s).convert('RGB')).unsqueeze(0)) for c, s in pairs]
+
+
+def _linear(weight: torch.Tensor, bias: torch.Tensor) -> nn.Linear:
+    linear = nn.Linear(weight.shape[1], weight.shape[0])
+    with torch.no_grad():
+        linear.weight.copy_(weight)
+        linear.bias.copy_(bias)
+    return linear
+
+
+def attach_attention_projections(transformer: nn.Module):
+    """
+    Give every nn.MultiheadAttention separate nn.Linear copies of its projections
+
+    nn.MultiheadAttention keeps its input projections in in_proj_weight and
+    its output projection in a linear that quantize_dynamic skips. The copies
+    (attn.in_proj_int8, with the q/k/v rows and the qk and kv pairs that
+    multi_head_attention packs, and attn.out_proj_int8) are what the sdpa and
+    chunked attention backends use once quantized; "native" keeps the float
+    module.
+    """
+    for attn in transformer.modules():
+        if not isinstance(attn, nn.MultiheadAttention) or not attn._qkv_same_embed_dim:
+            continue
+        E = attn.embed_dim
+        w = attn.in_proj_weight.detach()
+        b = attn.in_proj_bias.detach() if attn.in_proj_bias is not None else w.new_zeros(3 * E)
+        rows = {'q': slice(0, E), 'k': slice(E, 2 * E), 'v': slice(2 * E, 3 * E),
+                'qk': slice(0, 2 * E), 'kv': slice(E, 3 * E)}
+        attn.in_proj_int8 = nn.ModuleDict({name: _linear(w[r], b[r]) for name, r in rows.items()})
+        out_bias = attn.out_proj.bias if attn.out_proj.bias is not None else w.new_zeros(E)
+        attn.out_proj_int8 = _linear(attn.out_proj.weight.detach(), out_bias.detach())
+
+
+def quantize_transformer(transformer: nn.Module) -> nn.Module:
+    """Dynamic int8 quantization of the transformer's FFN linears and attention projections"""
+    attach_attention_projections(transformer)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return torch.ao.quantization.quantize_dynamic(transformer, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_decoder(decoder: nn.Module, calibration_inputs: Sequence[torch.Tensor]) -> nn.Module:
+    """Static int8 quantization of the CNN decoder, calibrated on transformer outputs"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        prepared = prepare_fx(copy.deepcopy(decoder).eval(), qconfig_mapping,
+                              example_inputs=(calibration_inputs[0],))
+        with torch.inference_mode():
+            for hs in calibration_inputs:
+                prepared(hs)
+        return convert_fx(prepared)
+
+
+def decoder_inputs(network: nn.Module, inputs: Sequence[Tuple[torch.Tensor, torch.Tensor]]) -> List[torch.Tensor]:
+    """Record what the CNN decoder receives while the network stylizes the given pairs"""
+    recorded = []
+    handle = network.decode.register_forward_pre_hook(lambda module, args: recorded.append(args[0].clone()))
+    try:
+        for content, style in inputs:
+            network.inference(content, style)
+    finally:
+        handle.remove()
+    return recorded
+
+
+def load_or_quantize(network: nn.Module, mode: str, cache_dir: str, checkpoint: str,
+                     calibration_pairs: Sequence[Tuple[str, str]] = (), transform: Callable = None) -> nn.Module:
+    """
+    Quantize a CPU StyTrans network in place, reusing the cached quantized modules when available
+
+    Args:
+        network: Float StyTrans network on CPU, in eval mode
+        mode: One of QUANTIZATION_MODES
+        cache_dir: Directory for the quantized modules
+        checkpoint: Fingerprint of the float checkpoints the network was loaded from
+        calibration_pairs: (content, style) image paths for calibrating the static decoder
+        transform: Preprocessing applied to the calibration images
+
+    Returns:
+        The same network with quantized transformer (and decoder for "static")
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"quantization mode should be one of {QUANTIZATION_MODES}, not {mode}")
+    engine = _select_engine()
+    cache_path = os.path.join(cache_dir, f"stytr2_{mode}_{engine}_{checkpoint}.pt")
+
+    # The transformer is pickled whole (the files are written by this function only) and the static
+    # decoder, an FX graph that does not unpickle, is saved as TorchScript; loading them skips
+    # quantize_dynamic and the calibration
+    decoder_path = os.path.join(cache_dir, f"stytr2_{mode}_{engine}_{checkpoint}_decoder.pt")
+    if os.path.exists(cache_path) and (mode != 'static' or os.path.exists(decoder_path)):
+        try:
+            transformer = torch.load(cache_path, weights_only=False)
+            if not isinstance(transformer, nn.Module):
+                raise ValueError("not a quantized module")
+            if mode == 'static':
+                network.decode = torch.jit.load(decoder_path)
+            network.transformer = transformer
+            logger.info(f"Loaded quantized modules from {cache_path}")
+            return network
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable quantization cache {cache_path}: {str(e)}")
+
+    network.transformer = quantize_transformer(network.transformer)
+    os.makedirs(cache_dir, exist_ok=True)
+    if mode == 'static':
+        if not calibration_pairs:
+            raise ValueError("static quantization needs calibration images")
+        logger.info(f"Calibrating int8 decoder on {len(calibration_pairs)} image pairs")
+        calibration = decoder_inputs(network, load_pairs(calibration_pairs, transform))
+        with warnings.catch_warnings(), torch.no_grad():
+            warnings.simplefilter('ignore')
+            network.decode = torch.jit.trace(quantize_decoder(network.decode, calibration), calibration[0])
+            _save(decoder_path, lambda tmp_path: torch.jit.save(network.decode, tmp_path))
+
+    _save(cache_path, lambda tmp_path: torch.save(network.transformer, tmp_path))
+    logger.info(f"Saved quantized modules to {cache_path}")
+
+    return network
+
+
+def _save(path: str, write: Callable[[str], None]):
+    """Write a cache file atomically, so concurrent processes never load partial files"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def psnr(a: torch.Tensor, b: torch.Tensor) -> float:
+    """Peak signal-to-noise ratio in dB between two images in [0, 1]"""
+    mse = torch.mean((a.clamp(0, 1) - b.clamp(0, 1)) ** 2).item()
+    return float('inf') if mse == 0 else 10 * torch.log10(torch.tensor(1.0 / mse)).item()
+
+
+def compare_networks(reference: nn.Module, candidate: nn.Module,
+                     inputs: Sequence[Tuple[torch.Tensor, torch.Tensor]]) -> Dict[str, float]:
+    """Time two networks on the same inputs and measure the candidate's PSNR against the reference"""
+    reference_time = candidate_time = 0.0
+    scores = []
+    for content, style in inputs:
+        start = time.perf_counter()
+        expected = reference.inference(content, style)
+        reference_time += time.perf_counter() - start
+        start = time.perf_counter()
+        output = candidate.inference(content, style)
+        candidate_time += time.perf_counter() - start
+        scores.append(psnr(output, expected))
+    return {
+        'reference_seconds': reference_time / len(inputs),
+        'candidate_seconds': candidate_time / len(inputs),
+        'speedup': reference_time / candidate_time,
+        'psnr_db': min(scores),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from style_transfer_tool import StyleTransferTool, test_transform
+
+    parser = argparse.ArgumentParser(description="Build the quantized StyTR-2 cache and compare it with the float model")
+    parser.add_argument('--mode', choices=QUANTIZATION_MODES, default='dynamic')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    float_tool = StyleTransferTool()
+    quantized_tool = StyleTransferTool(quantize=args.mode)
+    report = compare_networks(float_tool.network, quantized_tool.network,
+                              load_pairs(demo_calibration_pairs(), test_transform(512)))
+    print(f"float: {report['reference_seconds']:.2f}s/image, int8 ({args.mode}): "
+          f"{report['candidate_seconds']:.2f}s/image, speedup {report['speedup']:.2f}x, "
+          f"worst-case PSNR vs float {report['psnr_db']:.1f} dB")
@@ -0,0 +1,55 @@
+"""
+Single-flight coalescing of identical requests
+While a computation for a key is running, further requests with the same key
+attach to it and receive its result instead of starting the same work again.
+The key is forgotten as soon as the computation finishes, so only requests
+that overlap in time are coalesced.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    At most one running computation per key, shared by every caller of that key
+
+    The computation runs as its own task, so a caller that is cancelled (e.g.
+    its client disconnected) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Await call() for key, or the already running computation for key"""
+        task = self._flights.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.started += 1
+            task = asyncio.ensure_future(call())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Retrieve the exception so it is not reported as unhandled when every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        """Computations started, requests that joined a running one, and those running now"""
+        return {
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._flights),
+        }
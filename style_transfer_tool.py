@@ -5,15 +5,18 @@ This tool wraps the StyTR-2 style transfer functionality
 
 import os
 import sys
+import copy
+import queue
+import threading
 import torch
 import numpy as np
 from PIL import Image
-from typing import Optional, Tuple
+from typing import Annotated, Any, Callable, List, Literal, Optional, Tuple, Union
+from concurrent.futures import Future, ThreadPoolExecutor
 from langchain.tools import tool
 from pydantic import BaseModel, Field  # Updated to use pydantic directly
 import logging
 from torchvision import transforms
-from torchvision.utils import save_image
 
 # Add StyTR-2 to path
 STYTR2_PATH = os.path.join(os.path.dirname(__file__), 'StyTR-2')
@@ -24,10 +27,41 @@ import models.StyTR as StyTR
 import models.transformer as transformer
 from collections import OrderedDict
 import torch.nn as nn
+from style_memory_store import StyleMemoryStore, checkpoint_fingerprint
+from style_result_cache import ResultCache
+from style_transfer_preprocess import ImageLoader
+from style_transfer_quantization import demo_calibration_pairs, load_or_quantize
+from style_transfer_precision import autocast, guard_precision
+from style_transfer_compile import CompiledStylizer
+from style_transfer_onnx import export_onnx, onnx_paths
+from style_transfer_ort import OnnxStylizer
+from style_transfer_checkpoint import load_or_pack
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Patch size of StyTR.PatchEmbed
+PATCH_SIZE = 8
+
+def trim_to_patches(img, patch_size=PATCH_SIZE):
+    """Drop the bottom/right pixels PatchEmbed would ignore, so the output matches the input size"""
+    h, w = img.shape[-2:]
+    return img[..., :h - h % patch_size, :w - w % patch_size]
+
+def alpha_output_path(output_path: Optional[str], alpha: float) -> Optional[str]:
+    """Output path of one alpha in a sweep: out.jpg -> out_alpha0.5.jpg (None stays None)"""
+    if not output_path:
+        return None
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_alpha{alpha:g}{ext}"
+
+def to_pil(output: torch.Tensor) -> Image.Image:
+    """1xCxHxW or CxHxW image in [0, 1] to a PIL image, rounded like torchvision.utils.save_image"""
+    if output.dim() == 4:
+        output = output[0]
+    pixels = output.mul(255).add_(0.5).clamp_(0, 255).permute(1, 2, 0).to('cpu', torch.uint8).numpy()
+    return Image.fromarray(pixels)
+
 # Define test_transform function (from StyTR-2 test.py)
 def test_transform(size, crop=False):
     transform_list = []
@@ -36,6 +70,8 @@ def test_transform(size, crop=False):
     if crop:
         transform_list.append(transforms.CenterCrop(size))
     transform_list.append(transforms.ToTensor())
+    # Any aspect ratio works natively; only the partial patch at the edges is trimmed
+    transform_list.append(transforms.Lambda(trim_to_patches))
     transform = transforms.Compose(transform_list)
     return transform
 
@@ -44,24 +80,108 @@ class StyleTransferInput(BaseModel):
     content_image_path: str = Field(description="Path to the content image")
     style_image_path: str = Field(description="Path to the style image")
     output_path: Optional[str] = Field(default=None, description="Path for output image. If not provided, will generate based on input names")
-    alpha: float = Field(default=1.0, description="Style weight (0-1), higher means stronger style")
+    alpha: Union[float, Annotated[List[float], Field(min_length=1)]] = Field(default=1.0, description="Style weight (0-1), higher means stronger style. A list (e.g. [0.25, 0.5, 0.75, 1.0]) writes one image per weight from a single stylization")
+    alpha_blend: Literal["pixel", "feature"] = Field(default="pixel", description="How weights below 1 are applied: 'pixel' blends the output with the content image, 'feature' interpolates the network features (not with tile_size)")
+    tile_size: Optional[int] = Field(default=None, ge=8, description="Stylize at native resolution in overlapping tiles of this size (pixels) instead of resizing to 512. Use for large images")
+    overlap: int = Field(default=64, ge=0, description="Overlap in pixels between neighbouring tiles when tile_size is set, smaller than tile_size")
+    style_tokens: Optional[int] = Field(default=None, ge=1, description="Quality/speed knob: pool the style to this many tokens (e.g. 256) for faster decoding. None keeps all style tokens")
     
 class StyleTransferTool:
-    def __init__(self, model_dir: str = None):
-        """Initialize the style transfer model"""
+    def __init__(self, model_dir: str = None, style_memory_dir: str = None, tile_batch_size: int = 4,
+                 attention_backend: str = "sdpa", quantize: Optional[str] = None, precision: str = "fp32",
+                 compile_backend: Optional[str] = None, runtime: str = "torch", checkpoint_dtype: str = "fp32",
+                 result_cache_dir: str = None, result_cache_bytes: int = 512 * 1024 * 1024,
+                 image_cache_bytes: int = 256 * 1024 * 1024, max_image_pixels: int = Image.MAX_IMAGE_PIXELS,
+                 packed_dir: str = None, compile_dir: str = None, onnx_dir: str = None, ort_threads: int = 0):
+        """Initialize the style transfer model; the *_dir caches default to subdirectories of model_dir"""
         if model_dir is None:
             model_dir = os.path.join(STYTR2_PATH, 'experiments')
+        if style_memory_dir is None:
+            style_memory_dir = os.path.join(model_dir, 'style_memory')
         
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # "torch" or "onnx" (ONNX Runtime on CPU with ort_threads threads, graphs exported once to onnx_dir)
+        if runtime not in ('torch', 'onnx'):
+            raise ValueError(f"runtime should be 'torch' or 'onnx', not {runtime}")
+        self.runtime = runtime
+        if runtime == 'onnx' and (quantize or precision != 'fp32' or compile_backend):
+            logger.warning("quantize, precision and compile_backend only apply to the torch runtime, ignoring them")
+            quantize, precision, compile_backend = None, 'fp32', None
+        
+        self.device = torch.device("cuda" if torch.cuda.is_available() and runtime == 'torch' else "cpu")
         logger.info(f"Using device: {self.device}")
         
+        # Tiles stylized per forward in tiled mode; bounds peak memory for any input size
+        self.tile_batch_size = tile_batch_size
+        
+        # "sdpa" or "chunked" avoid materializing full attention score matrices; "native" is nn.MultiheadAttention
+        self.attention_backend = attention_backend
+        
+        # None, "dynamic" (int8 transformer linears) or "static" (also int8 decoder convs); CPU only
+        self.quantize = quantize
+        
         # Load models
         self.vgg_path = os.path.join(model_dir, 'vgg_normalised.pth')
         self.decoder_path = os.path.join(model_dir, 'decoder_iter_160000.pth')
         self.trans_path = os.path.join(model_dir, 'transformer_iter_160000.pth')
         self.embed_path = os.path.join(model_dir, 'embedding_iter_160000.pth')
         
-        self._load_models()
+        # "fp32" or "fp16" storage of the packed checkpoint under packed_dir; fp16 halves reads and page cache
+        self.checkpoint_dtype = checkpoint_dtype
+        self.packed_dir = packed_dir or os.path.join(model_dir, 'packed')
+        self.checkpoint = checkpoint_fingerprint(self.decoder_path, self.trans_path, self.embed_path)
+        if checkpoint_dtype != 'fp32':
+            self.checkpoint += f'-{checkpoint_dtype}'
+        
+        # The ONNX runtime needs the torch network only to export its graphs; load_vgg loads it on demand
+        self.network = None
+        self._network_lock = threading.Lock()
+        onnx_dir = onnx_dir or os.path.join(model_dir, 'onnx')
+        if runtime != 'onnx' or not all(os.path.exists(path) for path in onnx_paths(onnx_dir, self.checkpoint)):
+            self._load_models()
+            self._quantize_models(os.path.join(model_dir, 'quantized'))
+        
+        # "fp32" or "bf16" autocast; bf16 is refused when it drifts too far from fp32 on a reference image
+        if self.quantize and precision != 'fp32':
+            logger.warning(f"precision={precision} is not combined with quantized inference, using fp32")
+            precision = 'fp32'
+        self.precision = guard_precision(self.network, self.device, precision, test_transform(size=256, crop=False))
+        
+        # Quantized or bf16 encoders produce different style memories than the fp32 ones
+        style_checkpoint = checkpoint_fingerprint(self.trans_path, self.embed_path)
+        if self.checkpoint_dtype != 'fp32':
+            style_checkpoint += f'-{self.checkpoint_dtype}-weights'
+        if self.quantize:
+            style_checkpoint += '-int8'
+        elif self.precision != 'fp32':
+            style_checkpoint += f'-{self.precision}'
+        
+        # Precomputed style encodings, shared with other processes through style_memory_dir
+        self.style_memory = StyleMemoryStore(
+            style_memory_dir, style_checkpoint)
+        
+        # None, "torchscript" or "inductor"; compiled graphs serve every resolution and are cached under
+        # compile_dir, so restarts skip compilation
+        self.compiled = None
+        if compile_backend:
+            compile_key = '-'.join([self.checkpoint,
+                                    self.device.type, self.attention_backend, self.quantize or 'float', self.precision])
+            self.compiled = CompiledStylizer(self.network, compile_backend, compile_dir or os.path.join(model_dir, 'compiled'),
+                                             compile_key)
+        
+        self.ort = None
+        if self.runtime == 'onnx':
+            if self.network is not None:
+                export_onnx(self.network, onnx_dir, self.checkpoint)
+            self.onnx_paths = onnx_paths(onnx_dir, self.checkpoint)
+            self.ort = OnnxStylizer.from_dir(onnx_dir, self.checkpoint, num_threads=ort_threads)
+        
+        # Finished outputs keyed by input bytes and options under result_cache_dir; 0 bytes disables it
+        if result_cache_dir is None:
+            result_cache_dir = os.path.join(model_dir, 'results')
+        self.result_cache = ResultCache(result_cache_dir, result_cache_bytes) if result_cache_bytes > 0 else None
+        
+        # Decode-time downscaling and an LRU of preprocessed images; images above max_image_pixels are rejected
+        self.images = ImageLoader(image_cache_bytes, max_image_pixels)
         
     def _load_models(self):
         """Load all required models"""
@@ -71,41 +191,172 @@ class StyleTransferTool:
             hidden_dim = 512
         args = Args()
         
-        # Load VGG
-        self.vgg = StyTR.vgg
-        self.vgg.load_state_dict(torch.load(self.vgg_path))
-        self.vgg = nn.Sequential(*list(self.vgg.children())[:44])
+        # VGG only feeds the training losses; it is loaded on demand by load_vgg
+        self.vgg = None
         
-        # Load decoder
-        self.decoder = StyTR.decoder
-        new_state_dict = OrderedDict()
-        state_dict = torch.load(self.decoder_path)
-        for k, v in state_dict.items():
-            new_state_dict[k] = v
-        self.decoder.load_state_dict(new_state_dict)
-        
-        # Load transformer
+        # Load decoder, transformer and embeddings from one memory-mapped packed checkpoint,
+        # packed from the .pth files on the first start
+        # StyTR.decoder is a module-level definition; each instance owns its copy
+        self.decoder = copy.deepcopy(StyTR.decoder)
         self.Trans = transformer.Transformer()
-        new_state_dict = OrderedDict()
-        state_dict = torch.load(self.trans_path)
-        for k, v in state_dict.items():
-            new_state_dict[k] = v
-        self.Trans.load_state_dict(new_state_dict)
-        
-        # Load embeddings
         self.embedding = StyTR.PatchEmbed()
-        new_state_dict = OrderedDict()
-        state_dict = torch.load(self.embed_path)
-        for k, v in state_dict.items():
-            new_state_dict[k] = v
-        self.embedding.load_state_dict(new_state_dict)
+        self.packed_path = load_or_pack(
+            {'decoder': self.decoder, 'transformer': self.Trans, 'embedding': self.embedding},
+            {'decoder': self.decoder_path, 'transformer': self.trans_path, 'embedding': self.embed_path},
+            self.packed_dir, checkpoint_fingerprint(self.decoder_path, self.trans_path, self.embed_path),
+            self.checkpoint_dtype)
+        self.Trans.set_attention_backend(self.attention_backend)
         
         # Create the network
-        self.network = StyTR.StyTrans(self.vgg, self.decoder, self.embedding, self.Trans, args)
+        self.network = StyTR.StyTrans(None, self.decoder, self.embedding, self.Trans, args)
         self.network.eval()
         self.network.to(self.device)
         
-    def transfer_style(self, content_path: str, style_path: str, output_path: str, alpha: float = 1.0) -> str:
+    def _torch_network(self) -> nn.Module:
+        """The torch network, loaded on first use when the ONNX runtime started from exported graphs"""
+        with self._network_lock:
+            if self.network is None:
+                self._load_models()
+        return self.network
+        
+    def load_vgg(self):
+        """Attach the VGG encoder for loss-based evaluation (network.forward); inference never needs it"""
+        network = self._torch_network()
+        if self.vgg is None:
+            self.vgg = StyTR.load_vgg(self.vgg_path).to(self.device).eval()
+            network.set_encoder(self.vgg)
+        return self.vgg
+        
+    def _quantize_models(self, cache_dir: str):
+        """Swap in int8 modules, loading quantized weights from cache_dir or calibrating once"""
+        if not self.quantize:
+            return
+        if self.device.type != 'cpu':
+            logger.warning(f"Quantized inference is CPU only, ignoring quantize={self.quantize} on {self.device}")
+            self.quantize = None
+            return
+        load_or_quantize(self.network, self.quantize, cache_dir,
+                         self.checkpoint,
+                         demo_calibration_pairs(), test_transform(size=512, crop=False))
+        # A cached quantized transformer comes with the attention backend it was saved with
+        self.Trans = self.network.transformer
+        self.Trans.set_attention_backend(self.attention_backend)
+        
+    def _encode_style(self, style_path: str) -> torch.Tensor:
+        """Run PatchEmbed + encoder_s on a style image"""
+        return self._encode_style_image(trim_to_patches(self.images.load(style_path, 512)))
+        
+    def _encode_style_image(self, style: torch.Tensor) -> torch.Tensor:
+        """Run PatchEmbed + encoder_s on a CxHxW style tensor"""
+        if self.ort is not None:
+            return torch.from_numpy(self.ort.encode_style(style.unsqueeze(0).numpy()))
+        with autocast(self.device, self.precision):
+            style_memory = self.network.encode_style(style.to(self.device).unsqueeze(0))
+        return style_memory.float()
+        
+    def _get_style_memory(self, style_path: str, style_tokens: Optional[int] = None) -> torch.Tensor:
+        """Style memory from the store, encoding the style image only on a miss"""
+        style_memory = self.style_memory.get_or_compute(
+            style_path, 512, lambda: self._encode_style(style_path))
+        # The store keeps the full memory; token reduction is applied per request
+        return transformer.Transformer.reduce_style(style_memory.to(self.device), style_tokens)
+        
+    def _stylize(self, content: torch.Tensor, style_memory: torch.Tensor, tile_size: Optional[int], overlap: int) -> torch.Tensor:
+        """Run inference on a content batch, in overlapping tiles when tile_size is set"""
+        # Inference-only path: no VGG features or training losses
+        stylize_fn = self._ort_stylize if self.ort is not None else self.compiled or self.network.inference_batch
+        with autocast(self.device, self.precision):
+            if tile_size:
+                output = StyTR.stylize_tiled(content, style_memory, stylize_fn, PATCH_SIZE, tile_size=tile_size,
+                                             overlap=overlap, batch_size=self.tile_batch_size)
+            else:
+                output = stylize_fn(content, style_memory=style_memory)
+        return output.float()
+        
+    def _stylize_alphas(self, content: torch.Tensor, style_memory: torch.Tensor, alphas: List[float]) -> torch.Tensor:
+        """Interpolate the stylized and identity features of a 1xCxHxW content for every alpha, decoding once each"""
+        with autocast(self.device, self.precision):
+            output = self.network.stylize_alphas(content, style_memory, alphas)
+        return output.float()
+        
+    def _ort_stylize(self, content: torch.Tensor, style_memory: torch.Tensor = None) -> torch.Tensor:
+        """inference_batch on ONNX Runtime"""
+        return torch.from_numpy(self.ort.stylize(content.cpu().numpy(), style_memory.cpu().numpy()))
+        
+    def _save_output(self, output: torch.Tensor, content: torch.Tensor, alpha: float, output_path: Optional[str],
+                     encode: Optional[Callable[[Image.Image], Any]] = None, cache_key: Optional[str] = None):
+        """
+        Blend a 1xCxHxW output with its content image, save it if output_path is set and return encode(image)
+        
+        With cache_key the output is also stored in the result cache.
+        """
+        # Save output
+        output = output.cpu()
+        
+        # Apply alpha blending if needed
+        if alpha < 1.0:
+            output = output * alpha + content.cpu() * (1.0 - alpha)
+        
+        # Converted to 8-bit once for both the file and the encoded image
+        image = to_pil(output)
+        
+        if output_path:
+            # Ensure output directory exists before saving
+            output_dir = os.path.dirname(output_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            image.save(output_path)
+        
+        if cache_key:
+            if output_path:
+                self.result_cache.put(cache_key, output_path)
+            else:
+                self.result_cache.put_image(cache_key, image)
+        
+        return encode(image) if encode else None
+        
+    def _result_key(self, content_path: str, style_path: str, alpha: float, tile_size: Optional[int], overlap: int, style_tokens: Optional[int],
+                    alpha_blend: str = "pixel") -> Optional[str]:
+        """Result cache key of one request, None when the cache is disabled"""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.key(content_path, style_path, alpha=alpha,
+                                     alpha_blend=alpha_blend if alpha < 1.0 else None, tile_size=tile_size,
+                                     overlap=overlap if tile_size else None, style_tokens=style_tokens,
+                                     checkpoint=self.checkpoint, runtime=self.runtime,
+                                     attention_backend=self.attention_backend, quantize=self.quantize,
+                                     precision=self.precision)
+        
+    def _fetch_result(self, key: Optional[str], output_path: Optional[str],
+                      encode: Optional[Callable[[Image.Image], Any]] = None):
+        """
+        (True, encode(image)) on a result cache hit, else (False, None)
+        
+        The hit is also placed at output_path when one is given.
+        """
+        path = self.result_cache.fetch(key, output_path) if key else None
+        if path is None:
+            return False, None
+        if encode is None:
+            return True, None
+        try:
+            with Image.open(output_path or path) as image:
+                return True, encode(image.convert('RGB'))
+        except FileNotFoundError:
+            # Evicted by another process between the lookup and the read
+            return False, None
+        
+    def stats(self) -> dict:
+        """Result cache and image cache statistics of this engine"""
+        stats = {"image_cache": self.images.stats()}
+        if self.result_cache is not None:
+            stats["result_cache"] = self.result_cache.stats()
+        return stats
+        
+    def transfer_style(self, content_path: str, style_path: str, output_path: str,
+                       alpha: Union[float, List[float]] = 1.0,
+                       tile_size: Optional[int] = None, overlap: int = 64,
+                       style_tokens: Optional[int] = None, alpha_blend: str = "pixel") -> Union[str, List[str]]:
         """
         Perform style transfer
         
@@ -113,58 +364,264 @@ class StyleTransferTool:
             content_path: Path to content image
             style_path: Path to style image
             output_path: Path for output image
-            alpha: Style weight (0-1)
+            alpha: Style weight (0-1), or a list of weights that are all produced from one stylization
+            tile_size: If set, keep the content at native resolution and stylize it in tiles of this size
+            overlap: Overlap between neighbouring tiles in pixels
+            style_tokens: If set, pool the style memory to this many tokens (faster, slightly lower fidelity)
+            alpha_blend: "pixel" blends the output with the content image; "feature" interpolates the
+                transformer features with the content features before the CNN decoder (torch runtime, untiled)
             
         Returns:
-            Path to the output image
+            Path to the output image, or for a list of weights one path per weight (see alpha_output_path)
         """
+        if isinstance(alpha, list):
+            output_paths = [alpha_output_path(output_path, a) for a in alpha]
+            self._transfer_style(content_path, style_path, output_paths, alpha, tile_size, overlap,
+                                 style_tokens, alpha_blend)
+            return output_paths
+        self._transfer_style(content_path, style_path, [output_path], [alpha], tile_size, overlap,
+                             style_tokens, alpha_blend)
+        return output_path
+        
+    def _transfer_style(self, content_path: str, style_path: str, output_paths: List[Optional[str]],
+                        alphas: List[float], tile_size: Optional[int], overlap: int, style_tokens: Optional[int],
+                        alpha_blend: str, encode: Optional[Callable[[Image.Image], Any]] = None) -> list:
+        """Stylize one content image once for every alpha; returns encode(image) per alpha (None without encode)"""
+        if not alphas:
+            raise ValueError("alpha should be a weight or a non-empty list of weights")
+        if alpha_blend not in ('pixel', 'feature'):
+            raise ValueError(f"alpha_blend should be 'pixel' or 'feature', not {alpha_blend}")
+        if alpha_blend == 'feature' and (tile_size or self.ort is not None):
+            raise ValueError("alpha_blend='feature' needs the torch runtime without tile_size")
+        
         try:
-            # Load and preprocess images
-            content_tf = test_transform(size=512, crop=False)
-            style_tf = test_transform(size=512, crop=False)
-            
-            content = content_tf(Image.open(content_path).convert('RGB'))
-            style = style_tf(Image.open(style_path).convert('RGB'))
+            # A repeated request is answered from the result cache without running the network
+            keys = [self._result_key(content_path, style_path, a, tile_size, overlap, style_tokens, alpha_blend)
+                    for a in alphas]
+            hits = [self._fetch_result(key, path, encode) for key, path in zip(keys, output_paths)]
+            if all(hit for hit, _ in hits):
+                return [encoded for _, encoded in hits]
             
-            style = style.to(self.device).unsqueeze(0)
+            # Load and preprocess images; tiled mode keeps the content at native resolution
+            content = trim_to_patches(self.images.load(content_path, 0 if tile_size else 512))
             content = content.to(self.device).unsqueeze(0)
             
-            with torch.no_grad():
-                # Use the network directly
-                output = self.network(content, style)
+            # The style branch is skipped when the style memory is already stored
+            style_memory = self._get_style_memory(style_path, style_tokens)
             
-            # Save output
-            output = output.cpu()
+            # One network forward for all weights: either one output blended per weight in pixel space,
+            # or one transformer pass whose features are interpolated and decoded per weight
+            if alpha_blend == 'feature' and any(a < 1.0 for a in alphas):
+                outputs = self._stylize_alphas(content, style_memory, alphas).split(1)
+                blend_alphas = [1.0] * len(alphas)
+            else:
+                outputs = [self._stylize(content, style_memory, tile_size, overlap)] * len(alphas)
+                blend_alphas = alphas
             
-            # Apply alpha blending if needed
-            if alpha < 1.0:
-                output = output * alpha + content.cpu() * (1.0 - alpha)
+            encoded = []
+            for output, a, path, key in zip(outputs, blend_alphas, output_paths, keys):
+                encoded.append(self._save_output(output, content, a, path, encode, key))
+            return encoded
             
-            # Ensure output directory exists before saving
-            output_dir = os.path.dirname(output_path)
-            if output_dir:
-                os.makedirs(output_dir, exist_ok=True)
-                
-            save_image(output, output_path)
+        except Exception as e:
+            logger.error(f"Style transfer failed: {str(e)}")
+            raise
+            
+    def transfer_style_batch(self, content_paths: List[str], style_path: str, output_paths: List[str],
+                             alpha: float = 1.0, batch_size: int = 8,
+                             tile_size: Optional[int] = None, overlap: int = 64,
+                             style_tokens: Optional[int] = None) -> List[str]:
+        """
+        Perform style transfer of many content images with one style
+        
+        The style is encoded once. Content images of the same size are stacked
+        into batches of up to batch_size and stylized with one forward each.
+        
+        Args:
+            content_paths: Paths to content images
+            style_path: Path to style image
+            output_paths: Paths for output images, one per content image
+            alpha: Style weight (0-1)
+            batch_size: Maximum number of images per forward
+            tile_size: If set, stylize each content image at native resolution in tiles of this size
+            overlap: Overlap between neighbouring tiles in pixels
+            style_tokens: If set, pool the style memory to this many tokens (faster, slightly lower fidelity)
+            
+        Returns:
+            Paths to the output images
+        """
+        self._transfer_style_batch(content_paths, style_path, output_paths, alpha, batch_size,
+                                   tile_size, overlap, style_tokens)
+        return output_paths
+        
+    def _transfer_style_batch(self, content_paths: List[str], style_path: str, output_paths: List[Optional[str]],
+                              alpha: float, batch_size: int, tile_size: Optional[int], overlap: int,
+                              style_tokens: Optional[int], encode: Optional[Callable[[Image.Image], Any]] = None,
+                              return_exceptions: bool = False) -> list:
+        """
+        Stylize many content images with one style; returns encode(image) per image (None without encode)
+        
+        With return_exceptions an item that cannot be loaded, stylized or saved gets its exception in
+        place of a result and the other items are still produced; otherwise the first error is raised.
+        """
+        if len(content_paths) != len(output_paths):
+            raise ValueError("content_paths and output_paths must have the same length")
+        
+        encoded = [None] * len(content_paths)
+        
+        def fail(indices: List[int], error: Exception):
+            if not return_exceptions:
+                raise error
+            logger.error(f"Style transfer of {', '.join(content_paths[i] for i in indices)} failed: {str(error)}")
+            for i in indices:
+                encoded[i] = error
+        
+        try:
+            # Cached results are placed directly; only the misses are loaded and stylized
+            keys = [None] * len(content_paths)
+            contents = OrderedDict()
+            for i, (content_path, output_path) in enumerate(zip(content_paths, output_paths)):
+                try:
+                    keys[i] = self._result_key(content_path, style_path, alpha, tile_size, overlap, style_tokens)
+                    hit, encoded[i] = self._fetch_result(keys[i], output_path, encode)
+                    if not hit:
+                        # Tiled mode keeps the content at native resolution
+                        contents[i] = trim_to_patches(self.images.load(content_path, 0 if tile_size else 512))
+                except Exception as e:
+                    fail([i], e)
+            if not contents:
+                return encoded
+            
+            style_memory = self._get_style_memory(style_path, style_tokens)
+            
+            # Only same-sized images can be stacked into one batch; tiled mode batches tiles instead
+            groups = OrderedDict()
+            for i, content in contents.items():
+                groups.setdefault(i if tile_size else tuple(content.shape), []).append(i)
+            
+            for indices in groups.values():
+                for start in range(0, len(indices), batch_size):
+                    chunk = indices[start:start + batch_size]
+                    try:
+                        batch = torch.stack([contents[i] for i in chunk]).to(self.device)
+                        outputs = self._stylize(batch, style_memory, tile_size, overlap)
+                    except Exception as e:
+                        fail(chunk, e)
+                        continue
+                    for i, output in zip(chunk, outputs):
+                        try:
+                            encoded[i] = self._save_output(output.unsqueeze(0), contents[i].unsqueeze(0),
+                                                           alpha, output_paths[i], encode, keys[i])
+                        except Exception as e:
+                            fail([i], e)
             
-            return output_path
+            return encoded
             
         except Exception as e:
-            logger.error(f"Style transfer failed: {str(e)}")
+            logger.error(f"Batch style transfer failed: {str(e)}")
             raise
 
+def tool_options_from_env() -> dict:
+    """StyleTransferTool options from the STYLE_TRANSFER_* environment variables, shared with the MCP server"""
+    return dict(
+        # "torch" or "onnx" (ONNX Runtime on CPU with STYLE_TRANSFER_ORT_THREADS threads)
+        runtime=os.environ.get('STYLE_TRANSFER_RUNTIME', 'torch'),
+        tile_batch_size=int(os.environ.get('STYLE_TRANSFER_TILE_BATCH_SIZE', 4)),
+        attention_backend=os.environ.get('STYLE_TRANSFER_ATTENTION', 'sdpa'),
+        quantize=os.environ.get('STYLE_TRANSFER_QUANTIZE') or None,
+        precision=os.environ.get('STYLE_TRANSFER_PRECISION', 'fp32'),
+        compile_backend=os.environ.get('STYLE_TRANSFER_COMPILE') or None,
+        checkpoint_dtype=os.environ.get('STYLE_TRANSFER_CHECKPOINT_DTYPE', 'fp32'),
+        ort_threads=int(os.environ.get('STYLE_TRANSFER_ORT_THREADS', 0)),
+        # Cache directories default to subdirectories of StyTR-2/experiments
+        style_memory_dir=os.environ.get('STYLE_MEMORY_DIR'),
+        packed_dir=os.environ.get('STYLE_TRANSFER_PACKED_DIR'),
+        compile_dir=os.environ.get('STYLE_TRANSFER_COMPILE_DIR'),
+        onnx_dir=os.environ.get('STYLE_TRANSFER_ONNX_DIR'),
+        # STYLE_TRANSFER_RESULT_CACHE_MB=0 and STYLE_TRANSFER_IMAGE_CACHE_MB=0 disable the caches
+        result_cache_dir=os.environ.get('STYLE_TRANSFER_RESULT_CACHE_DIR'),
+        result_cache_bytes=int(float(os.environ.get('STYLE_TRANSFER_RESULT_CACHE_MB', 512)) * 1024 * 1024),
+        image_cache_bytes=int(float(os.environ.get('STYLE_TRANSFER_IMAGE_CACHE_MB', 256)) * 1024 * 1024),
+        max_image_pixels=int(os.environ.get('STYLE_TRANSFER_MAX_PIXELS', Image.MAX_IMAGE_PIXELS)),
+    )
+
+class StyleTransferPool:
+    """
+    N StyleTransferTool replicas served by N worker threads
+    
+    Each worker limits its intra-op threads to threads_per_replica, so
+    concurrent requests run side by side on disjoint cores instead of all
+    competing for every core. Replicas load the same packed checkpoint, whose
+    fp32 weights are views of one shared file mapping. Offers the
+    transfer_style/transfer_style_batch methods of StyleTransferTool; calls
+    block until a replica is free, submit() returns a Future instead.
+    """
+    
+    def __init__(self, num_replicas: int, threads_per_replica: Optional[int] = None, **tool_kwargs):
+        if num_replicas < 1:
+            raise ValueError(f"num_replicas should be at least 1, not {num_replicas}")
+        if threads_per_replica is None:
+            threads_per_replica = max(torch.get_num_threads() // num_replicas, 1)
+        self.threads_per_replica = threads_per_replica
+        
+        self.replicas = [StyleTransferTool(**tool_kwargs) for _ in range(num_replicas)]
+        self._idle = queue.Queue()
+        for replica in self.replicas:
+            self._idle.put(replica)
+        # torch.set_num_threads applies to the calling thread's OpenMP team
+        self._executor = ThreadPoolExecutor(max_workers=num_replicas, thread_name_prefix="style-transfer",
+                                            initializer=torch.set_num_threads, initargs=(threads_per_replica,))
+        
+    def _run(self, method: str, *args, **kwargs):
+        replica = self._idle.get()
+        try:
+            return getattr(replica, method)(*args, **kwargs)
+        finally:
+            self._idle.put(replica)
+        
+    def submit(self, method: str, *args, **kwargs) -> Future:
+        """Run a StyleTransferTool method, e.g. "transfer_style", on the next idle replica"""
+        return self._executor.submit(self._run, method, *args, **kwargs)
+        
+    def transfer_style(self, *args, **kwargs) -> Union[str, List[str]]:
+        return self.submit('transfer_style', *args, **kwargs).result()
+        
+    def transfer_style_batch(self, *args, **kwargs) -> List[str]:
+        return self.submit('transfer_style_batch', *args, **kwargs).result()
+        
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
 # Global instance
 _tool_instance = None
+_tool_instance_lock = threading.Lock()
 
 def get_tool_instance():
-    """Get or create tool instance"""
+    """
+    Get or create the shared engine
+    
+    A StyleTransferPool of STYLE_TRANSFER_REPLICAS replicas when that is
+    above 1 (STYLE_TRANSFER_THREADS_PER_REPLICA sets their thread budget),
+    otherwise a single StyleTransferTool. Both are configured with the
+    STYLE_TRANSFER_* variables of the MCP server (see tool_options_from_env).
+    """
     global _tool_instance
     if _tool_instance is None:
-        _tool_instance = StyleTransferTool()
+        with _tool_instance_lock:
+            if _tool_instance is None:
+                options = tool_options_from_env()
+                replicas = int(os.environ.get('STYLE_TRANSFER_REPLICAS', 1))
+                if replicas > 1:
+                    threads = os.environ.get('STYLE_TRANSFER_THREADS_PER_REPLICA')
+                    _tool_instance = StyleTransferPool(replicas, int(threads) if threads else None, **options)
+                else:
+                    _tool_instance = StyleTransferTool(**options)
     return _tool_instance
 
 @tool("style_transfer", args_schema=StyleTransferInput, return_direct=False)
-def style_transfer(content_image_path: str, style_image_path: str, output_path: Optional[str] = None, alpha: float = 1.0) -> str:
+def style_transfer(content_image_path: str, style_image_path: str, output_path: Optional[str] = None,
+                   alpha: Union[float, List[float]] = 1.0, tile_size: Optional[int] = None, overlap: int = 64,
+                   style_tokens: Optional[int] = None, alpha_blend: str = "pixel") -> str:
     """
     Apply artistic style transfer to an image using StyTR-2.
     
@@ -175,7 +632,15 @@ def style_transfer(content_image_path: str, style_image_path: str, output_path:
         content_image_path: Path to the content image (the image you want to transform)
         style_image_path: Path to the style image (the artistic style to apply)
         output_path: Optional path for the output image. If not provided, will auto-generate
-        alpha: Style strength (0.0-1.0). Higher values mean stronger style application
+        alpha: Style strength (0.0-1.0). Higher values mean stronger style application.
+               A list of strengths writes one image per strength from a single stylization
+        tile_size: Optional tile size in pixels. Large images are then stylized at native
+                   resolution in overlapping tiles instead of being resized to 512
+        overlap: Overlap between tiles in pixels (only used with tile_size)
+        style_tokens: Optional number of style tokens to keep (e.g. 256). Lower is faster,
+                      None keeps the full style for best quality
+        alpha_blend: "pixel" blends the output with the content image, "feature" interpolates
+                     the network features instead (not with tile_size)
         
     Returns:
         Path to the generated stylized image
@@ -191,8 +656,11 @@ def style_transfer(content_image_path: str, style_image_path: str, output_path:
     
     # Get tool instance and perform transfer
     tool = get_tool_instance()
-    result_path = tool.transfer_style(content_image_path, style_image_path, output_path, alpha)
+    result_path = tool.transfer_style(content_image_path, style_image_path, output_path, alpha, tile_size, overlap,
+                                      style_tokens, alpha_blend)
     
+    if isinstance(result_path, list):
+        return f"Style transfer completed! Outputs saved to: {', '.join(result_path)}"
     return f"Style transfer completed! Output saved to: {result_path}"
 
 # For testing
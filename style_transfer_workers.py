@@ -0,0 +1,271 @@
+"""
+Multi-process inference workers for the MCP server
+Worker processes are spawned rather than forked: forking the threaded server
+after the model has run OpenMP forwards can deadlock the children. Each
+worker builds its own engine from a picklable factory; the fp32 weights of
+the memory-mapped packed checkpoint are shared between processes through the
+page cache. Requests go to whichever worker is idle and run with its own
+torch thread budget. A worker that dies fails only the request it was
+running and is replaced by a new one.
+"""
+
+import os
+import atexit
+import logging
+import threading
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import connection
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(engine_factory: Callable[[], Any], num_threads: int, conn):
+    """Worker loop: build the engine, report ready, then run engine methods sent on conn"""
+    torch.set_num_threads(num_threads)
+    engine = engine_factory()
+    conn.send((None, True, None))
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        task_id, method, args, kwargs = task
+        try:
+            conn.send((task_id, True, getattr(engine, method)(*args, **kwargs)))
+        except Exception as e:
+            conn.send((task_id, False, f"{type(e).__name__}: {str(e)}"))
+
+
+class WorkerPool:
+    """
+    num_workers spawned processes, each running an engine built by engine_factory
+
+    Args:
+        engine_factory: Picklable callable returning a loaded CPU engine (StyleTransferModel)
+        num_workers: Number of worker processes
+        threads_per_worker: torch intra-op threads per worker; defaults to an even split of the cores
+    """
+
+    def __init__(self, engine_factory: Callable[[], Any], num_workers: int, threads_per_worker: int = None):
+        if num_workers < 1:
+            raise ValueError(f"num_workers should be at least 1, not {num_workers}")
+        if threads_per_worker is None:
+            threads_per_worker = max((os.cpu_count() or 1) // num_workers, 1)
+        self.engine_factory = engine_factory
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.restarts = 0
+
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pending: Dict[int, Future] = {}
+        self._backlog = deque()
+        # Tasks for one particular worker (submit_all), sent before the shared backlog
+        self._targeted = [deque() for _ in range(num_workers)]
+        self._ids = itertools.count()
+        # Per worker slot: process, pipe, id of the running task, and whether its engine is loaded;
+        # a slot whose worker died while loading is retired (process None)
+        self._processes = [None] * num_workers
+        self._conns = [None] * num_workers
+        self._running: list = [None] * num_workers
+        self._ready = [False] * num_workers
+
+        for index in range(num_workers):
+            self._start_worker(index)
+        # Workers load concurrently; the pool serves once all of them are ready
+        for index in range(num_workers):
+            try:
+                self._conns[index].recv()
+            except EOFError:
+                self._processes[index].join()
+                exitcode = self._processes[index].exitcode
+                for process in self._processes:
+                    process.terminate()
+                raise RuntimeError(f"Inference worker {index} exited with code {exitcode} while loading")
+            self._ready[index] = True
+        logger.info(f"Started {num_workers} inference workers with {threads_per_worker} threads each")
+
+        self._collector = threading.Thread(target=self._collect, name="style-transfer-results", daemon=True)
+        self._collector.start()
+        # Daemonic workers are terminated at interpreter exit, which must not start replacements
+        atexit.register(self._stop_restarts)
+
+    def _start_worker(self, index: int):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, name=f"style-transfer-worker-{index}", daemon=True,
+                                        args=(self.engine_factory, self.threads_per_worker, child_conn))
+        process.start()
+        # Only the worker holds the other end, so its exit shows up as EOF here
+        child_conn.close()
+        with self._lock:
+            self._processes[index] = process
+            self._conns[index] = parent_conn
+            self._running[index] = None
+            self._ready[index] = False
+
+    def _collect(self):
+        """Resolve the futures of finished tasks and replace workers that exited"""
+        while True:
+            with self._lock:
+                watch = {}
+                for index, process in enumerate(self._processes):
+                    if process is not None:
+                        watch[self._conns[index]] = index
+                        watch[process.sentinel] = index
+            if not watch:
+                break
+            for ready in connection.wait(list(watch)):
+                index = watch[ready]
+                if ready is self._conns[index]:
+                    try:
+                        message = ready.recv()
+                    except (EOFError, OSError):
+                        self._processes[index].join()
+                        self._replace(index)
+                        continue
+                    self._finished(index, *message)
+                elif self._processes[index] is not None and ready == self._processes[index].sentinel:
+                    self._replace(index)
+
+    def _finished(self, index: int, task_id: Optional[int], ok: bool, result: Any):
+        with self._lock:
+            if task_id is None:
+                # A replacement worker finished loading its engine
+                self._ready[index] = True
+                future = None
+            else:
+                future = self._pending.pop(task_id, None)
+            self._running[index] = None
+            self._dispatch(index)
+        if future is None:
+            return
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(result))
+
+    def _replace(self, index: int):
+        """Fail the task of the exited worker at index and start a new worker in its place"""
+        process, conn = self._processes[index], self._conns[index]
+        with self._lock:
+            # No further tasks are sent to the exited worker
+            loaded = self._ready[index]
+            self._ready[index] = False
+        # Results sent just before the exit are still delivered
+        try:
+            while conn.poll():
+                task_id, ok, result = conn.recv()
+                if task_id is None:
+                    loaded = True
+                else:
+                    self._finished(index, task_id, ok, result)
+        except (EOFError, OSError):
+            pass
+        conn.close()
+        process.join()
+
+        with self._lock:
+            task_id = self._running[index]
+            futures = [self._pending.pop(task_id, None)] if task_id is not None else []
+            # Tasks meant for this worker are not run by its replacement
+            while self._targeted[index]:
+                futures.append(self._pending.pop(self._targeted[index].popleft()[0], None))
+            self._processes[index] = None
+            self._running[index] = None
+            self._ready[index] = False
+            closed = self._closed
+        for future in futures:
+            if future is not None:
+                future.set_exception(RuntimeError(f"Inference worker exited with code {process.exitcode}"))
+        if closed:
+            return
+
+        if loaded:
+            logger.error(f"Inference worker {index} exited with code {process.exitcode}, starting a new one")
+            self.restarts += 1
+            self._start_worker(index)
+        else:
+            # A worker that cannot load its engine would fail again; keep serving with the others
+            logger.error(f"Inference worker {index} exited with code {process.exitcode} while loading, not restarting it")
+            with self._lock:
+                if all(process is None for process in self._processes):
+                    self._fail_backlog(RuntimeError("No inference workers left"))
+
+    def _dispatch(self, index: int):
+        """Send the next queued task to the idle worker at index; the lock must be held"""
+        queue = self._targeted[index] or self._backlog
+        if self._closed or not queue or not self._ready[index] or self._running[index] is not None:
+            return
+        task = queue.popleft()
+        self._running[index] = task[0]
+        self._conns[index].send(task)
+
+    def _fail_backlog(self, error: Exception):
+        """Fail every task not yet sent to a worker; the lock must be held"""
+        for queue in [self._backlog] + self._targeted:
+            while queue:
+                future = self._pending.pop(queue.popleft()[0], None)
+                if future is not None:
+                    future.set_exception(error)
+
+    def submit(self, method: str, *args, **kwargs) -> Future:
+        """Run an engine method, e.g. "transfer_style", on the next idle worker"""
+        future = Future()
+        with self._lock:
+            if self._closed or all(process is None for process in self._processes):
+                future.set_exception(RuntimeError("WorkerPool is shut down" if self._closed else "No inference workers left"))
+                return future
+            task_id = next(self._ids)
+            self._pending[task_id] = future
+            self._backlog.append((task_id, method, args, kwargs))
+            for index in range(self.num_workers):
+                if self._ready[index] and self._running[index] is None:
+                    self._dispatch(index)
+                    break
+        return future
+
+    def submit_all(self, method: str, *args, **kwargs) -> List[Future]:
+        """Run an engine method, e.g. "stats", once on every live worker, after the task it is running"""
+        futures = []
+        with self._lock:
+            for index, process in enumerate(self._processes):
+                if process is None or self._closed:
+                    continue
+                future = Future()
+                task_id = next(self._ids)
+                self._pending[task_id] = future
+                self._targeted[index].append((task_id, method, args, kwargs))
+                futures.append(future)
+                self._dispatch(index)
+        return futures
+
+    def stats(self) -> dict:
+        """Workers alive, busy and restarted, and tasks waiting for a worker"""
+        with self._lock:
+            return {
+                "workers": sum(process is not None for process in self._processes),
+                "busy": sum(task_id is not None for task_id in self._running),
+                "queued": len(self._backlog),
+                "restarts": self.restarts,
+            }
+
+    def _stop_restarts(self):
+        with self._lock:
+            self._closed = True
+
+    def shutdown(self):
+        """Stop the workers after they finish their current task; queued tasks fail"""
+        with self._lock:
+            self._closed = True
+            self._fail_backlog(RuntimeError("WorkerPool is shut down"))
+            for conn, process in zip(self._conns, self._processes):
+                if process is not None:
+                    conn.send(None)
+        self._collector.join()
@@ -0,0 +1,106 @@
+"""
+Tests for style_result_cache
+"""
+
+import os
+
+import pytest
+from PIL import Image
+
+from style_result_cache import ResultCache
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    content, style = tmp_path / "content.png", tmp_path / "style.png"
+    content.write_bytes(b"content")
+    style.write_bytes(b"style")
+    return str(content), str(style)
+
+
+def _output(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def test_key_depends_on_bytes_and_options(tmp_path, inputs):
+    content, style = inputs
+    cache = ResultCache(str(tmp_path / "cache"), 1 << 20)
+    key = cache.key(content, style, alpha=1.0, tile_size=None)
+
+    assert cache.key(content, style, tile_size=None, alpha=1.0) == key
+    assert cache.key(content, style, alpha=0.5, tile_size=None) != key
+    assert cache.key(style, content, alpha=1.0, tile_size=None) != key
+
+    with open(content, 'ab') as f:
+        f.write(b"edited")
+    assert cache.key(content, style, alpha=1.0, tile_size=None) != key
+
+
+def test_put_and_fetch(tmp_path, inputs):
+    cache = ResultCache(str(tmp_path / "cache"), 1 << 20)
+    key = cache.key(*inputs, alpha=1.0)
+    output = _output(tmp_path, "out.jpg", 1000)
+    fetched = str(tmp_path / "again" / "out.jpg")
+
+    assert not cache.fetch(key, fetched)
+    cache.put(key, output)
+    assert cache.fetch(key, fetched)
+
+    with open(output, 'rb') as a, open(fetched, 'rb') as b:
+        assert a.read() == b.read()
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_overwriting_a_fetched_output_keeps_the_entry(tmp_path, inputs):
+    cache = ResultCache(str(tmp_path / "cache"), 1 << 20)
+    key = cache.key(*inputs)
+    output = _output(tmp_path, "out.jpg", 1000)
+    cache.put(key, output)
+    expected = open(output, 'rb').read()
+
+    assert cache.fetch(key, output)
+    with open(output, 'wb') as f:
+        f.write(b"another result")
+
+    assert cache.fetch(key, str(tmp_path / "copy.jpg"))
+    assert open(tmp_path / "copy.jpg", 'rb').read() == expected
+
+
+def test_evicts_least_recently_used_to_budget(tmp_path, inputs):
+    cache_dir = tmp_path / "cache"
+    cache = ResultCache(str(cache_dir), 2500)
+    keys = [cache.key(*inputs, alpha=alpha) for alpha in (0.25, 0.5, 0.75)]
+    for i, key in enumerate(keys[:2]):
+        cache.put(key, _output(tmp_path, f"out{i}.jpg", 1000))
+        # Distinct modification times order the entries regardless of timestamp resolution
+        os.utime(cache_dir / f"{key}.jpg", ns=(i * 10 ** 9, i * 10 ** 9))
+
+    # A hit refreshes the first entry, so the second is now the least recently used
+    assert cache.fetch(keys[0], str(tmp_path / "hit.jpg"))
+    cache.put(keys[2], _output(tmp_path, "out2.jpg", 1000))
+
+    assert sorted(os.listdir(cache_dir)) == sorted([f"{keys[0]}.jpg", f"{keys[2]}.jpg"])
+    assert cache.stats()["bytes"] == 2000
+    assert not cache.fetch(keys[1], str(tmp_path / "miss.jpg"))
+
+
+def test_entries_are_found_by_key_alone(tmp_path, inputs):
+    cache = ResultCache(str(tmp_path / "cache"), 1 << 20)
+    key = cache.key(*inputs, alpha=1.0)
+    image = Image.new('RGB', (16, 8), (200, 100, 50))
+
+    assert cache.fetch(key) is None
+    cache.put_image(key, image)
+
+    path = cache.fetch(key)
+    assert path == str(tmp_path / "cache" / f"{key}.png")
+    with Image.open(path) as cached:
+        assert cached.tobytes() == image.tobytes()
+
+    # Outputs in another format are converted rather than copied
+    assert cache.fetch(key, str(tmp_path / "out.jpg")) == path
+    with Image.open(tmp_path / "out.jpg") as output:
+        assert output.format == 'JPEG' and output.size == (16, 8)
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
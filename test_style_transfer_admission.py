@@ -0,0 +1,64 @@
+"""
+Tests for style_transfer_admission
+"""
+
+import asyncio
+
+import pytest
+
+from style_transfer_admission import AdmissionQueue, ServerBusy
+
+
+def test_rejects_beyond_in_flight_plus_queued():
+    async def main():
+        queue = AdmissionQueue(max_in_flight=2, max_queued=1, initial_seconds=4.0)
+        release = asyncio.Event()
+
+        async def request():
+            async with queue.slot():
+                await release.wait()
+
+        running = [asyncio.ensure_future(request()) for _ in range(3)]
+        await asyncio.sleep(0)
+        with pytest.raises(ServerBusy) as busy:
+            async with queue.slot():
+                pass
+        admitted = queue.admitted
+        release.set()
+        await asyncio.gather(*running)
+        return queue, busy.value, admitted
+
+    queue, busy, admitted = asyncio.run(main())
+
+    assert admitted == 3
+    assert busy.admitted == 3 and busy.retry_after == 4.0
+    assert queue.stats()["admitted"] == 0
+    assert queue.stats()["rejected"] == 1
+
+
+def test_slot_is_released_on_error():
+    async def main():
+        queue = AdmissionQueue(max_in_flight=1, max_queued=0)
+        with pytest.raises(RuntimeError):
+            async with queue.slot():
+                raise RuntimeError("stylization failed")
+        async with queue.slot():
+            pass
+        return queue
+
+    assert asyncio.run(main()).admitted == 0
+
+
+def test_retry_after_follows_observed_run_time():
+    queue = AdmissionQueue(max_in_flight=2, max_queued=8, initial_seconds=5.0)
+    queue.observe(1.0)
+    assert queue.mean_seconds == pytest.approx(4.2)
+
+    queue.admitted = 6
+    # With 6 admitted on 2 slots, a new request gets a slot after three waves of runs
+    assert queue.retry_after() == round(3 * 4.2, 1)
+
+
+def test_max_in_flight_must_be_positive():
+    with pytest.raises(ValueError):
+        AdmissionQueue(max_in_flight=0)
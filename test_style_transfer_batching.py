@@ -0,0 +1,86 @@
+"""
+Tests for style_transfer_batching
+"""
+
+import asyncio
+
+import pytest
+
+from style_transfer_batching import MicroBatcher
+
+
+def test_batches_concurrent_items_per_key():
+    calls = []
+
+    async def run_batch(key, items):
+        calls.append((key, list(items)))
+        return [f"{key}:{item}" for item in items]
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=0.05, max_batch=8)
+        results = await asyncio.gather(*[batcher.submit(i % 2, i) for i in range(6)])
+        return batcher, results
+
+    batcher, results = asyncio.run(main())
+
+    assert results == [f"{i % 2}:{i}" for i in range(6)]
+    assert sorted(calls) == [(0, [0, 2, 4]), (1, [1, 3, 5])]
+    assert batcher.stats()["mean_batch_size"] == 3.0
+
+
+def test_max_batch_dispatches_immediately():
+    sizes = []
+
+    async def run_batch(key, items):
+        sizes.append(len(items))
+        return items
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=10.0, max_batch=2)
+        return await asyncio.wait_for(asyncio.gather(*[batcher.submit('k', i) for i in range(4)]), timeout=5)
+
+    assert asyncio.run(main()) == [0, 1, 2, 3]
+    assert sizes == [2, 2]
+
+
+def test_exception_result_fails_only_its_item():
+    async def run_batch(key, items):
+        return [ValueError(f"bad {item}") if item == 'bad' else item for item in items]
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=0.05)
+        return await asyncio.gather(*[batcher.submit('k', item) for item in ['a', 'bad', 'c']],
+                                    return_exceptions=True)
+
+    a, bad, c = asyncio.run(main())
+
+    assert (a, c) == ('a', 'c')
+    assert isinstance(bad, ValueError)
+
+
+def test_failed_batch_is_retried_item_by_item():
+    calls = []
+
+    async def run_batch(key, items):
+        calls.append(list(items))
+        if 'bad' in items:
+            raise RuntimeError("cannot decode bad")
+        return items
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=0.05)
+        results = await asyncio.gather(*[batcher.submit('k', item) for item in ['a', 'bad', 'c']],
+                                       return_exceptions=True)
+        return batcher, results
+
+    batcher, (a, bad, c) = asyncio.run(main())
+
+    assert (a, c) == ('a', 'c')
+    assert isinstance(bad, RuntimeError)
+    assert calls == [['a', 'bad', 'c'], ['a'], ['bad'], ['c']]
+    assert batcher.stats()["retried"] == 3
+
+
+def test_max_batch_must_be_positive():
+    with pytest.raises(ValueError):
+        MicroBatcher(lambda key, items: items, max_batch=0)
@@ -0,0 +1,100 @@
+"""
+Tests for style_transfer_checkpoint
+"""
+
+import os
+
+import pytest
+import torch
+import torch.nn as nn
+
+from style_transfer_checkpoint import PackedCheckpoint, load_or_pack, pack_state_dicts
+
+
+def _state_dicts():
+    torch.manual_seed(0)
+    return {
+        'decoder': {'conv.weight': torch.randn(8, 4, 3, 3), 'conv.bias': torch.randn(8),
+                    # Non-contiguous, integer and empty tensors
+                    'proj.weight': torch.randn(5, 7).t(), 'bn.num_batches_tracked': torch.tensor(12),
+                    'empty': torch.empty(0, 3)},
+        'embedding': {'proj.weight': torch.randn(16, 3, 2, 2), 'half': torch.randn(3, dtype=torch.bfloat16)},
+    }
+
+
+def test_fp32_round_trip(tmp_path):
+    path = str(tmp_path / "packed" / "model.safetensors")
+    state_dicts = _state_dicts()
+
+    pack_state_dicts(state_dicts, path, metadata={'checkpoint': 'abc'})
+    packed = PackedCheckpoint(path)
+
+    assert packed.metadata == {'checkpoint': 'abc', 'dtype': 'fp32'}
+    assert len(packed) == 7
+    for component, state_dict in state_dicts.items():
+        loaded = packed.state_dict(component)
+        assert loaded.keys() == state_dict.keys()
+        for name, tensor in state_dict.items():
+            expected = tensor.float() if tensor.is_floating_point() else tensor
+            assert loaded[name].dtype == expected.dtype
+            assert torch.equal(loaded[name], expected)
+
+
+def test_tensors_are_aligned_views(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    pack_state_dicts(_state_dicts(), path)
+    packed = PackedCheckpoint(path)
+
+    for name in packed:
+        tensor = packed.tensor(name)
+        if tensor.numel():
+            assert tensor.data_ptr() % 64 == 0
+
+
+def test_fp16_storage(tmp_path):
+    fp32, fp16 = str(tmp_path / "fp32.safetensors"), str(tmp_path / "fp16.safetensors")
+    state_dicts = _state_dicts()
+    pack_state_dicts(state_dicts, fp32)
+    pack_state_dicts(state_dicts, fp16, dtype='fp16')
+
+    packed = PackedCheckpoint(fp16)
+    weight = packed.state_dict('decoder')['conv.weight']
+
+    assert packed.tensor('decoder.conv.weight').dtype == torch.float16
+    assert weight.dtype == torch.float32
+    torch.testing.assert_close(weight, state_dicts['decoder']['conv.weight'], rtol=1e-3, atol=1e-3)
+    assert packed.state_dict('decoder')['bn.num_batches_tracked'].dtype == torch.int64
+    assert os.path.getsize(fp16) < os.path.getsize(fp32)
+
+
+class Tiny(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = nn.Linear(4, 3)
+        self.norm = nn.BatchNorm1d(3)
+
+
+def test_load_or_pack(tmp_path):
+    torch.manual_seed(0)
+    source = Tiny()
+    checkpoint_path = str(tmp_path / "tiny.pth")
+    torch.save(source.state_dict(), checkpoint_path)
+    cache_dir = str(tmp_path / "packed")
+
+    target = Tiny()
+    path = load_or_pack({'decoder': target}, {'decoder': checkpoint_path}, cache_dir, 'tiny')
+
+    assert os.path.exists(path)
+    for name, tensor in source.state_dict().items():
+        assert torch.equal(target.state_dict()[name], tensor)
+
+    # The next load reads the packed file, not the .pth
+    os.unlink(checkpoint_path)
+    again = Tiny()
+    assert load_or_pack({'decoder': again}, {'decoder': checkpoint_path}, cache_dir, 'tiny') == path
+    assert torch.equal(again.linear.weight, source.linear.weight)
+
+
+def test_load_or_pack_rejects_unknown_dtype(tmp_path):
+    with pytest.raises(ValueError):
+        load_or_pack({}, {}, str(tmp_path), 'x', dtype='int8')
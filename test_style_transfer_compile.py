@@ -0,0 +1,84 @@
+"""
+Tests for style_transfer_compile on a randomly initialized network
+"""
+
+import copy
+import os
+import sys
+import warnings
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'StyTR-2'))
+
+import models.StyTR as StyTR
+import models.transformer as transformer
+from style_transfer_compile import CompiledStylizer
+
+
+class Args:
+    position_embedding = 'sine'
+    hidden_dim = 512
+
+
+@pytest.fixture(scope="module")
+def network():
+    torch.manual_seed(0)
+    network = StyTR.StyTrans(None, copy.deepcopy(StyTR.decoder), StyTR.PatchEmbed(), transformer.Transformer(), Args())
+    network.transformer.set_attention_backend("sdpa")
+    return network.eval()
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        yield
+
+
+def _graph_files(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith('.pt'))
+
+
+def test_one_graph_serves_every_resolution(network, tmp_path):
+    stylizer = CompiledStylizer(network, 'torchscript', str(tmp_path), 'test')
+    torch.manual_seed(1)
+    for shape, tokens in [((32, 48), 16), ((48, 32), 24), ((64, 64), 16)]:
+        content = torch.rand(1, 3, *shape)
+        style_memory = torch.randn(tokens, 1, 512)
+
+        torch.testing.assert_close(stylizer(content, style_memory),
+                                   network.inference_batch(content, style_memory=style_memory))
+
+    assert list(stylizer._graphs) == ['single']
+    assert _graph_files(str(tmp_path)) == ['torchscript_test_single.pt']
+
+
+def test_loaded_graph_shares_parameters(network, tmp_path):
+    content, style_memory = torch.rand(1, 3, 32, 32), torch.randn(16, 1, 512)
+    CompiledStylizer(network, 'torchscript', str(tmp_path), 'test')(content, style_memory)
+
+    stylizer = CompiledStylizer(network, 'torchscript', str(tmp_path), 'test')
+    output = stylizer(content, style_memory)
+
+    name = 'transformer.decoder.layers.0.multihead_attn.in_proj_weight'
+    loaded = dict(stylizer._graphs['single'].named_parameters())[name]
+    assert loaded.data_ptr() == network.get_parameter(name).data_ptr()
+    torch.testing.assert_close(output, network.inference_batch(content, style_memory=style_memory))
+
+
+def test_graphs_are_bounded(network, tmp_path):
+    chunked = copy.deepcopy(network)
+    chunked.transformer.set_attention_backend("chunked", chunk_size=8)
+    stylizer = CompiledStylizer(chunked, 'torchscript', str(tmp_path), 'test', max_graphs=2, max_bytes=1)
+    style_memory = torch.randn(16, 1, 512)
+
+    # 16, 32 and 48 content tokens: one graph per number of query chunks, the oldest dropped
+    for height in (32, 64, 96):
+        content = torch.rand(1, 3, height, 32)
+        torch.testing.assert_close(stylizer(content, style_memory),
+                                   chunked.inference_batch(content, style_memory=style_memory))
+
+    assert list(stylizer._graphs) == ['single_c4', 'single_c6']
+    assert _graph_files(str(tmp_path)) == []
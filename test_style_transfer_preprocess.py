@@ -0,0 +1,70 @@
+"""
+Tests for style_transfer_preprocess
+"""
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from style_transfer_preprocess import ImageLoader, load_image
+
+
+def _save(tmp_path, image, name):
+    path = tmp_path / name
+    image.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize("mode", ["P", "1", "I;16", "L", "RGBA", "CMYK"])
+def test_load_image_reduces_any_mode(tmp_path, mode):
+    """Large images of every mode are reduced and returned as 3xHxW uint8 with the short side at size"""
+    rgb = Image.fromarray(np.random.default_rng(0).integers(0, 256, (1200, 1600, 3), dtype=np.uint8))
+    if mode == "P":
+        image = rgb.quantize(64)
+    elif mode == "I;16":
+        image = Image.fromarray(np.random.default_rng(0).integers(0, 65536, (1200, 1600), dtype=np.uint16))
+    else:
+        image = rgb.convert(mode)
+    path = _save(tmp_path, image, "large.tiff" if mode in ("I;16", "CMYK") else "large.png")
+
+    output = load_image(path, 256)
+
+    assert output.dtype == torch.uint8
+    assert tuple(output.shape) == (3, 256, 341)
+
+
+def test_load_image_palette_matches_rgb(tmp_path):
+    """A palette image decodes to the same pixels as its RGB conversion"""
+    rgb = Image.fromarray(np.random.default_rng(1).integers(0, 256, (1024, 1024, 3), dtype=np.uint8))
+    palette = rgb.quantize(32)
+    from_palette = load_image(_save(tmp_path, palette, "palette.png"), 512)
+    from_rgb = load_image(_save(tmp_path, palette.convert("RGB"), "rgb.png"), 512)
+
+    assert torch.equal(from_palette, from_rgb)
+
+
+def test_load_image_native_size(tmp_path):
+    """size=0 keeps the native resolution"""
+    path = _save(tmp_path, Image.new("P", (100, 60)), "small.png")
+
+    assert tuple(load_image(path, 0).shape) == (3, 60, 100)
+
+
+def test_load_image_rejects_oversized(tmp_path):
+    path = _save(tmp_path, Image.new("RGB", (200, 200)), "big.png")
+
+    with pytest.raises(ValueError):
+        load_image(path, 64, max_pixels=100 * 100)
+
+
+def test_image_loader_caches(tmp_path):
+    path = _save(tmp_path, Image.new("RGB", (300, 200), "red"), "red.png")
+    loader = ImageLoader()
+
+    first = loader.load(path, 64)
+    second = loader.load(path, 64)
+
+    assert torch.equal(first, second)
+    assert first.max() <= 1.0
+    assert loader.stats()["hits"] == 1 and loader.stats()["misses"] == 1
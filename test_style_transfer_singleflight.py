@@ -0,0 +1,80 @@
+"""
+Tests for style_transfer_singleflight
+"""
+
+import asyncio
+
+import pytest
+
+from style_transfer_singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    calls = []
+
+    async def compute(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return f"result {key}"
+
+    async def main():
+        flights = SingleFlight()
+        results = await asyncio.gather(*[flights.do(key, lambda key=key: compute(key)) for key in "aaab"])
+        return flights, results
+
+    flights, results = asyncio.run(main())
+
+    assert results == ["result a"] * 3 + ["result b"]
+    assert sorted(calls) == ["a", "b"]
+    assert flights.stats() == {"started": 2, "coalesced": 2, "in_flight": 0}
+
+
+def test_key_is_forgotten_after_completion():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        flights = SingleFlight()
+        return [await flights.do("k", compute), await flights.do("k", compute)]
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    attempts = []
+
+    async def fail():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("bad image")
+
+    async def main():
+        flights = SingleFlight()
+        results = await asyncio.gather(flights.do("k", fail), flights.do("k", fail), return_exceptions=True)
+        with pytest.raises(ValueError):
+            await flights.do("k", fail)
+        return results
+
+    results = asyncio.run(main())
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(attempts) == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        flights = SingleFlight()
+        first = asyncio.ensure_future(flights.do("k", compute))
+        second = asyncio.ensure_future(flights.do("k", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(main()) == ("done", True)
@@ -0,0 +1,77 @@
+"""
+Tests for style_transfer_workers
+"""
+
+import os
+
+import pytest
+
+from style_transfer_workers import WorkerPool
+
+
+class FakeEngine:
+    """Stands in for StyleTransferModel; module level so spawned workers can unpickle it"""
+
+    def add(self, a, b):
+        return a + b
+
+    def fail(self):
+        raise ValueError("bad input")
+
+    def crash(self):
+        os._exit(3)
+
+    def pid(self):
+        return os.getpid()
+
+
+def broken_engine():
+    raise RuntimeError("cannot load")
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(FakeEngine, num_workers=2, threads_per_worker=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_results_and_errors(pool):
+    futures = [pool.submit('add', i, 1) for i in range(10)]
+    assert [future.result(timeout=30) for future in futures] == list(range(1, 11))
+
+    with pytest.raises(RuntimeError, match="ValueError: bad input"):
+        pool.submit('fail').result(timeout=30)
+
+
+def test_dead_worker_fails_its_task_and_is_replaced(pool):
+    with pytest.raises(RuntimeError, match="exited with code 3"):
+        pool.submit('crash').result(timeout=30)
+
+    # The replacement serves requests once it has loaded
+    assert pool.submit('add', 2, 3).result(timeout=60) == 5
+    assert pool.stats()["restarts"] == 1
+    assert pool.stats()["workers"] == 2
+
+
+def test_submit_all_runs_once_per_worker(pool):
+    # Queued behind a busy worker's current task rather than taken by the idle one
+    busy = pool.submit('add', 1, 1)
+    pids = [future.result(timeout=30) for future in pool.submit_all('pid')]
+
+    assert busy.result(timeout=30) == 2
+    assert len(set(pids)) == 2 and os.getpid() not in pids
+
+
+def test_worker_that_cannot_load():
+    with pytest.raises(RuntimeError, match="while loading"):
+        WorkerPool(broken_engine, num_workers=2, threads_per_worker=1)
+
+
+def test_shutdown_fails_new_tasks():
+    pool = WorkerPool(FakeEngine, num_workers=1, threads_per_worker=1)
+    assert pool.submit('add', 1, 1).result(timeout=30) == 2
+    pool.shutdown()
+
+    with pytest.raises(RuntimeError):
+        pool.submit('add', 1, 1).result(timeout=30)
@@ -0,0 +1,113 @@
+"""
+Tests for the sdpa and chunked attention backends of the StyTR-2 transformer
+"""
+
+import copy
+import os
+import sys
+
+import pytest
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'StyTR-2'))
+
+from models.transformer import Transformer, multi_head_attention
+from style_transfer_quantization import quantize_transformer
+
+L, S, N, E, HEADS = 40, 24, 3, 64, 4
+
+
+@pytest.fixture(scope="module")
+def attn():
+    torch.manual_seed(0)
+    attn = nn.MultiheadAttention(E, HEADS)
+    # Non-zero biases so every slice of the packed projection is exercised
+    nn.init.normal_(attn.in_proj_bias)
+    nn.init.normal_(attn.out_proj.bias)
+    return attn.eval()
+
+
+def _inputs(case):
+    torch.manual_seed(1)
+    query = torch.randn(L, N, E)
+    if case == "qkv":
+        return query, query, query
+    if case == "qk":
+        return query, query, torch.randn(L, N, E)
+    memory = torch.randn(S, N, E)
+    if case == "kv":
+        return query, memory, memory
+    if case == "separate":
+        return query, memory, torch.randn(S, N, E)
+    # One style memory broadcast over the batch (stride 0), as inference_batch passes it
+    shared = torch.randn(S, 1, E)
+    if case == "broadcast_kv":
+        memory = shared.expand(S, N, E)
+        return query, memory, memory
+    if case == "broadcast":
+        return query, shared.expand(S, N, E), torch.randn(S, 1, E).expand(S, N, E)
+    raise ValueError(case)
+
+
+@pytest.mark.parametrize("backend", ["sdpa", "chunked"])
+@pytest.mark.parametrize("case", ["qkv", "qk", "kv", "separate", "broadcast_kv", "broadcast"])
+def test_backend_matches_multihead_attention(attn, backend, case):
+    query, key, value = _inputs(case)
+    if case == "broadcast_kv":
+        assert key.stride(1) == 0
+
+    with torch.no_grad():
+        expected = attn(query, key, value, need_weights=False)[0]
+        # chunk_size below L splits the queries into uneven blocks
+        output = multi_head_attention(attn, query, key, value, backend=backend, chunk_size=16)
+
+    torch.testing.assert_close(output, expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("backend", ["sdpa", "chunked"])
+def test_masks_fall_back_to_native(attn, backend):
+    query, key, value = _inputs("kv")
+    mask = torch.zeros(N, S, dtype=torch.bool)
+    mask[:, -4:] = True
+
+    with torch.no_grad():
+        expected = attn(query, key, value, key_padding_mask=mask, need_weights=False)[0]
+        output = multi_head_attention(attn, query, key, value, key_padding_mask=mask, backend=backend)
+
+    torch.testing.assert_close(output, expected)
+
+
+@pytest.mark.parametrize("backend", ["sdpa", "chunked"])
+def test_transformer_backend_matches_native(backend):
+    """A whole encode/decode pass, with a broadcast style memory, is unchanged by the backend"""
+    torch.manual_seed(2)
+    model = Transformer().eval()
+    content, style = torch.randn(N, 512, 6, 5), torch.randn(1, 512, 4, 4)
+
+    def run():
+        with torch.no_grad():
+            memory_s = model.encode_style(style).expand(-1, N, -1)
+            memory_c, pos_embed_c = model.encode_content(content)
+            return model.decode(memory_c, memory_s, pos_embed_c, (6, 5))
+
+    model.set_attention_backend("native")
+    expected = run()
+    model.set_attention_backend(backend, chunk_size=7)
+    output = run()
+
+    torch.testing.assert_close(output, expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("case", ["qkv", "qk", "kv", "separate", "broadcast_kv"])
+def test_int8_projections_replace_float_ones(attn, case):
+    """Quantized in/out projections run under sdpa and stay close to the float attention"""
+    quantized = quantize_transformer(nn.ModuleList([copy.deepcopy(attn)]))[0]
+    query, key, value = _inputs(case)
+
+    with torch.no_grad():
+        expected = attn(query, key, value, need_weights=False)[0]
+        output = multi_head_attention(quantized, query, key, value, backend="sdpa")
+
+    assert not torch.allclose(output, expected, rtol=1e-4, atol=1e-5)
+    torch.testing.assert_close(output, expected, rtol=0, atol=0.1)
@@ -0,0 +1,60 @@
+"""
+Tests for the inference stages of StyTR-2 on a randomly initialized network
+"""
+
+import copy
+import os
+import sys
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'StyTR-2'))
+
+import models.StyTR as StyTR
+import models.transformer as transformer
+
+
+class Args:
+    position_embedding = 'sine'
+    hidden_dim = 512
+
+
+@pytest.fixture(scope="module")
+def network():
+    torch.manual_seed(0)
+    network = StyTR.StyTrans(None, copy.deepcopy(StyTR.decoder), StyTR.PatchEmbed(), transformer.Transformer(), Args())
+    return network.eval()
+
+
+@pytest.fixture(scope="module")
+def images():
+    torch.manual_seed(1)
+    return torch.rand(1, 3, 64, 48), torch.rand(1, 3, 64, 64)
+
+
+def test_stylize_alphas_endpoints(network, images):
+    """alpha=1 is the plain stylization, alpha=0 the content identity decoding (Icc of forward)"""
+    content, style = images
+    style_memory = network.encode_style(style)
+
+    outputs = network.stylize_alphas(content, style_memory, [0.0, 0.5, 1.0])
+
+    with torch.inference_mode():
+        embedded = network.embedding(content)
+        identity = network.decode(network.transformer(embedded, None, embedded, None, None))
+    stylized = network.stylize(network.encode_content(content), style_memory)
+    assert outputs.shape == (3, 3, 64, 48)
+    torch.testing.assert_close(outputs[0:1], identity)
+    torch.testing.assert_close(outputs[2:3], stylized)
+    assert not torch.allclose(outputs[1:2], identity) and not torch.allclose(outputs[1:2], stylized)
+
+
+def test_inference_stages_match_inference(network, images):
+    content, style = images
+
+    expected = network.inference(content, style)
+
+    torch.testing.assert_close(network.inference_batch(content.repeat(2, 1, 1, 1), style), expected.repeat(2, 1, 1, 1))
+    torch.testing.assert_close(network.inference(content_memory=network.encode_content(content),
+                                                 style_memory=network.encode_style(style)), expected)
@@ -0,0 +1,74 @@
+"""
+Tests for the tiled inference helpers of StyTR-2
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'StyTR-2'))
+
+from models.StyTR import StyTrans, _feather_mask, _tile_starts
+
+
+@pytest.mark.parametrize("length,tile,overlap", [(512, 512, 64), (1000, 256, 64), (1000, 256, 0),
+                                                 (777, 128, 127), (300, 512, 64)])
+def test_tile_starts_cover_length(length, tile, overlap):
+    starts = _tile_starts(length, tile, overlap)
+
+    assert starts[0] == 0
+    assert starts == sorted(set(starts))
+    assert starts[-1] == max(length - tile, 0)
+    # Neighbouring tiles overlap by at least overlap pixels, so no gap is left
+    assert all(b - a <= tile - overlap for a, b in zip(starts, starts[1:]))
+
+
+def test_tile_starts_step_min():
+    """A step below step_min (overlap close to tile) is raised to step_min"""
+    starts = _tile_starts(64, 16, 15, step_min=8)
+
+    assert starts == [0, 8, 16, 24, 32, 40, 48]
+
+
+def test_feather_mask():
+    mask = _feather_mask(32, 48, 8)
+
+    assert mask.shape == (32, 48)
+    assert torch.all(mask > 0)
+    assert mask.max() == 1.0
+    assert torch.equal(mask, mask.flip(0)) and torch.equal(mask, mask.flip(1))
+    assert mask[0, 0] == pytest.approx((1 / 9) ** 2)
+    assert torch.all(mask[8:-8, 8:-8] == 1.0)
+
+
+def test_feather_mask_without_overlap():
+    assert torch.all(_feather_mask(16, 16, 0) == 1.0)
+
+
+def _fake_network():
+    return SimpleNamespace(embedding=SimpleNamespace(patch_size=(8, 8)))
+
+
+def _identity(tiles, style_memory):
+    return tiles
+
+
+@pytest.mark.parametrize("tile_size,overlap", [(64, 16), (48, 0), (64, 56), (512, 64)])
+def test_inference_tiled_blends_back_to_input(tile_size, overlap):
+    """With an identity stylization the feathered tiles reassemble the input exactly"""
+    content = torch.rand(2, 3, 136, 200)
+
+    output = StyTrans.inference_tiled(_fake_network(), content, style_memory=torch.zeros(1), tile_size=tile_size,
+                                      overlap=overlap, batch_size=3, stylize_fn=_identity)
+
+    torch.testing.assert_close(output, content)
+
+
+@pytest.mark.parametrize("tile_size,overlap", [(4, 0), (64, 64), (64, 100), (64, -1)])
+def test_inference_tiled_rejects_bad_tiling(tile_size, overlap):
+    with pytest.raises(ValueError):
+        StyTrans.inference_tiled(_fake_network(), torch.rand(1, 3, 64, 64), style_memory=torch.zeros(1),
+                                 tile_size=tile_size, overlap=overlap, stylize_fn=_identity)